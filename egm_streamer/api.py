@@ -1,18 +1,20 @@
+import asyncio
 import contextlib
-import threading
 import time
 import shutil
 import json
+from email.utils import formatdate
 from pathlib import Path
 from typing import Optional, Dict, List
 
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Response, Request
+from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
 from .config import AppConfig
-from .detector import EgmStateDetector
+from .detector import EgmStateDetector, FRAME_WAIT_TIMEOUT
 from .streamer import Streamer
 from .models import StreamStatus
 from .capture import StreamCapturer, PersistentCapturer, StreamConfig as CapturerStreamConfig
@@ -22,7 +24,7 @@ detector_instance: Optional[EgmStateDetector] = None
 app_config: Optional[AppConfig] = None
 streamers: Dict[str, Streamer] = {}
 persistent_capturer: Optional[PersistentCapturer] = None
-stop_event = threading.Event()
+stop_event: Optional[asyncio.Event] = None
 
 @contextlib.asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -37,23 +39,32 @@ async def lifespan(app: FastAPI):
                 except Exception as e:
                     print(f"[Startup] Failed to create refs dir {refs_dir}: {e}")
     
+    # Background loops run as tasks on the server's event loop (no dedicated OS threads);
+    # blocking work inside them is offloaded to the default executor
+    global stop_event
+    stop_event = asyncio.Event()
+    tasks = []
+
     # Start detector loop
     if detector_instance and detector_instance.config.detector.enabled:
-        detect_thread = threading.Thread(target=detection_loop, daemon=True)
-        detect_thread.start()
+        tasks.append(asyncio.create_task(detection_loop()))
     
     # Snapshot loop startup (Independent of detector instance)
     if app_config and app_config.snapshot.enabled:
-        snap_thread = threading.Thread(target=snapshot_loop, daemon=True)
-        snap_thread.start()
+        tasks.append(asyncio.create_task(snapshot_loop()))
 
     yield
-    # Shutdown
+    # Shutdown: wake every loop at once instead of waiting out their sleeps
     stop_event.set()
-    if detector_instance and 'detect_thread' in locals():
-        detect_thread.join(timeout=2.0)
-    if 'snap_thread' in locals():
-        snap_thread.join(timeout=2.0)
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=7.0)
+        # Stragglers are cancelled; their in-flight thread calls still run to completion (see _in_thread)
+        for t in pending:
+            t.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    # Every loop (and its worker threads) has finished with the watcher: release the inotify fd and its watches
+    if detector_instance:
+        detector_instance.close()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -69,23 +80,51 @@ app.add_middleware(
 # Loops
 # -------------------------
 
-def detection_loop():
+async def _in_thread(func, *args):
+    """
+    asyncio.to_thread, but a cancelled caller still waits for the thread to return:
+    cancelling can't stop the thread, and shutdown must not close what it is using.
+    """
+    fut = asyncio.ensure_future(asyncio.to_thread(func, *args))
+    try:
+        return await asyncio.shield(fut)
+    except asyncio.CancelledError:
+        await asyncio.wait([fut])
+        raise
+
+async def _sleep_or_stop(seconds: float) -> None:
+    """Sleep up to `seconds`, returning early once shutdown is requested."""
+    try:
+        await asyncio.wait_for(stop_event.wait(), timeout=seconds)
+    except asyncio.TimeoutError:
+        pass
+
+async def detection_loop():
     global detector_instance
     if not detector_instance:
         return
     
     print("Background detection loop started")
     while not stop_event.is_set():
-        detector_instance.step()
+        # Measure step() itself so the loop keeps the configured pace (monotonic: immune to clock jumps)
+        t0 = time.monotonic()
+        await _in_thread(detector_instance.step)
+        dt = time.monotonic() - t0
         
-        t0 = time.time()
-        dt = time.time() - t0
         interval = detector_instance.config.detector.capture.capture_interval
-        sleep_time = max(0.1, interval - dt)
+        sleep_time = max(0.0, interval - dt)
         
-        stop_event.wait(sleep_time)
-
-def snapshot_loop():
+        await _sleep_or_stop(sleep_time)
+        
+        # capture_interval is the minimum spacing; then wait for the snapshot service to write a fresh
+        # frame instead of re-matching the old one (1s slices so shutdown stays prompt)
+        waited = 0.0
+        while not stop_event.is_set() and waited < FRAME_WAIT_TIMEOUT:
+            if await _in_thread(detector_instance.frame_watcher.wait, 1.0):
+                break
+            waited += 1.0
+
+async def snapshot_loop():
     """
     持久化截圖迴圈：使用單一 FFmpeg 進程持續截圖
     只建立一次 SRS 連線，大幅減少 on_play/on_stop 事件
@@ -109,23 +148,25 @@ def snapshot_loop():
 
     # Create persistent capturer (single long-running FFmpeg process)
     sc = CapturerStreamConfig(url=url, scale="640:-1", quality=snap_cfg.quality) 
-    persistent_capturer = PersistentCapturer(sc, snap_cfg.output_path, snap_cfg.interval)
+    persistent_capturer = PersistentCapturer(sc, snap_cfg.output_path, snap_cfg.interval,
+                                             snap_cfg.gray_path, snap_cfg.atomic_writes)
     
     # Start the persistent FFmpeg process
-    if not persistent_capturer.start():
+    if not await asyncio.to_thread(persistent_capturer.start):
         print("[Snapshot] Failed to start persistent capturer")
         return
     
     # Monitor loop: just ensure the process is running, auto-restart if needed
-    while not stop_event.is_set():
-        persistent_capturer.ensure_running()
-        # Check every 5 seconds (not every capture interval)
-        stop_event.wait(5.0)
-    
-    # Cleanup on shutdown
-    print("[Snapshot] Stopping persistent capturer...")
-    persistent_capturer.stop()
-    persistent_capturer = None
+    try:
+        while not stop_event.is_set():
+            await _in_thread(persistent_capturer.ensure_running)
+            # Check every 5 seconds (not every capture interval)
+            await _sleep_or_stop(5.0)
+    finally:
+        # Cleanup on shutdown (also when cancelled, so FFmpeg isn't left running)
+        print("[Snapshot] Stopping persistent capturer...")
+        await asyncio.to_thread(persistent_capturer.stop)
+        persistent_capturer = None
 
 # -------------------------
 # API Endpoints
@@ -133,10 +174,15 @@ def snapshot_loop():
 
 @app.get("/api/state")
 def get_state():
-    """Get current detection state (from status file or instance)"""
+    """Get current detection state (from instance memory, or status file before the first step)"""
     if not detector_instance:
         return {"error": "Detector disabled or not initialized"}
     
+    # Fast path: detection loop keeps the latest serialized status in memory
+    data = detector_instance.last_status
+    if data is not None:
+        return Response(content=data, media_type="application/json")
+    
     path = detector_instance.config.detector.output.status_file
     try:
         with open(path, "r") as f:
@@ -183,6 +229,15 @@ def control_stream(name: str, req: StreamControlReq):
 
 # --- Reference Management ---
 
+def _copy_snapshot(src, dst):
+    """
+    Copy the live snapshot to a ref / output file.
+    Must stay a real copy, not os.link: ffmpeg (-update 1) rewrites the snapshot file in place,
+    so a hardlinked ref would change with the next frame. copyfile uses sendfile() on Linux
+    (kernel-side copy) and skips the extra chmod that shutil.copy does.
+    """
+    shutil.copyfile(src, dst)
+
 #Helper to get config independent of detector state
 def get_detector_config():
     if detector_instance:
@@ -234,11 +289,11 @@ def add_ref(state: str):
         filename = f"ref_{ts}.jpg"
         dst = ref_dir / filename
         
-        shutil.copy(tmp_path, dst)
+        _copy_snapshot(tmp_path, dst)
         
-        # Reload detector refs if running
+        # Reload detector refs if running (only the new file gets hashed)
         if detector_instance:
-            detector_instance.ref_mgr.load_all()
+            detector_instance.ref_mgr.reload_state(state)
         
         return {"status": "saved", "filename": filename}
 
@@ -260,7 +315,6 @@ def get_ref_image(state: str, filename: str):
     path = ref_dir / filename
     
     if path.exists():
-        from fastapi.responses import FileResponse
         return FileResponse(path, media_type="image/jpeg", headers={"Cache-Control": "max-age=3600"})
     else:
         raise HTTPException(404, "File not found")
@@ -277,25 +331,59 @@ def delete_ref(state: str, filename: str):
     
     if path.exists():
         path.unlink()
-        # Reload detector refs if running
+        # Reload detector refs if running (forced: the delete shows up immediately instead of after the 1 s refs-scan throttle)
         if detector_instance:
-             detector_instance.ref_mgr.load_all()
+             detector_instance.ref_mgr.reload_state(state)
         return {"status": "deleted"}
     else:
         raise HTTPException(404, "File not found")
 
+@app.post("/api/rebuild")
+def rebuild_refs():
+    """Force re-decode + re-hash of every ref (same as `rebuild` CLI), e.g. after changing hash settings"""
+    if not detector_instance:
+        raise HTTPException(400, "Detector disabled or not initialized")
+    detector_instance.ref_mgr.invalidate_cache()
+    detector_instance.ref_mgr.load_all()
+    return {"status": "rebuilt"}
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match check: "*" or any listed entity tag equal to etag (weak comparison, W/ ignored)"""
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+def _snapshot_file_response(request: Request, path: Path) -> Response:
+    """Serve a live jpeg with an mtime-based ETag; unchanged frames get a bodyless 304."""
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        raise HTTPException(404, "Snapshot not yet available")
+    etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    headers = {
+        # no-cache = 每次都回源验证, 配合 ETag 仍然保证实时
+        "Cache-Control": "no-cache",
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+    }
+    if _etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    # 复用 stat 结果, 避免 FileResponse 再 stat 一次; 大文件由 starlette 走 sendfile
+    return FileResponse(path, media_type="image/jpeg", headers=headers, stat_result=st)
+
 @app.get("/api/live/frame")
-def get_live_frame():
+def get_live_frame(request: Request):
     """Get the latest snapshot frame for preview (from snapshot service)"""
     if not app_config or not app_config.snapshot.enabled:
         raise HTTPException(404, "Snapshot service disabled")
     
-    path = Path(app_config.snapshot.output_path)
-    if not path.exists():
-        raise HTTPException(404, "Snapshot not yet available")
-    
-    from fastapi.responses import FileResponse
-    return FileResponse(path, media_type="image/jpeg", headers={"Cache-Control": "no-cache"})
+    return _snapshot_file_response(request, Path(app_config.snapshot.output_path))
 
 # --- Snapshot / Preview ---
 
@@ -319,15 +407,19 @@ def save_snapshot(req: SnapshotReq):
     out.mkdir(parents=True, exist_ok=True)
     
     saved = []
+    # Fixed schedule (t0 + i*interval): the copy time doesn't stretch the period
+    t0 = time.monotonic()
     try:
         for i in range(req.count):
             ts = int(time.time() * 1000)
             dst = out / f"{req.prefix}_{ts}_{i}.jpg"
-            shutil.copy(snap_path, dst)
+            _copy_snapshot(snap_path, dst)
             saved.append(str(dst))
             
             if i < req.count - 1 and req.interval_ms > 0:
-                time.sleep(req.interval_ms / 1000.0)
+                remaining = t0 + (i + 1) * req.interval_ms / 1000.0 - time.monotonic()
+                if remaining > 0:
+                    time.sleep(remaining)
                 
     except Exception as e:
         raise HTTPException(500, f"Snapshot save failed: {e}")
@@ -336,18 +428,12 @@ def save_snapshot(req: SnapshotReq):
 
 
 @app.get("/api/snapshot/latest")
-def get_latest_snapshot():
+def get_latest_snapshot(request: Request):
     """Get the latest image from the background snapshot service"""
     if not app_config or not app_config.snapshot.enabled:
         raise HTTPException(404, "Snapshot service disabled")
         
-    path = Path(app_config.snapshot.output_path)
-    if not path.exists():
-        raise HTTPException(404, "Snapshot not yet available")
-        
-    from fastapi.responses import FileResponse
-    # Disable cache to ensure live update
-    return FileResponse(path, media_type="image/jpeg", headers={"Cache-Control": "no-cache, no-store, must-revalidate"})
+    return _snapshot_file_response(request, Path(app_config.snapshot.output_path))
 
 
 # --- Static Files ---
@@ -2,6 +2,7 @@ import os
 import time
 import subprocess
 import threading
+from collections import deque
 from pathlib import Path
 from typing import Optional
 from PIL import Image
@@ -10,19 +11,129 @@ from .models import StreamConfig
 class CaptureError(Exception):
     pass
 
+def _stderr_tail(data: Optional[bytes], limit: int = 4096) -> str:
+    """Decode only the last `limit` bytes of captured stderr (a failing FFmpeg can be very chatty)"""
+    if not data:
+        return "unknown error"
+    return data[-limit:].decode("utf-8", "replace")
+
+def drop_page_cache(path) -> None:
+    """
+    寫完就不會再讀的檔案 (e.g. 連拍輸出到實體磁碟)：提示 kernel 釋放它的 page cache，避免擠掉有用的快取
+    不做 fdatasync：Linux 的 DONTNEED 會對 dirty pages 啟動非同步 writeback (不等它完成)，只丟掉已經乾淨的 pages。
+    所以剛寫完時呼叫一次 = 開始寫回；等寫回完成後再呼叫一次才真的釋放 (見 cli.cmd_snapshot)
+    只是提示，失敗或平台不支援時忽略
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
 class StreamCapturer:
-    """單次截圖器 (舊版，每次呼叫建立新連線)"""
+    """
+    單次截圖器 (舊版，每次呼叫建立新連線)
+    連拍時可先 start_stream()：改用一個常駐 FFmpeg 把 MJPEG 寫到 pipe，capture() 每次從 pipe 取一張
+    """
     def __init__(self, config: StreamConfig, output_path: str = "/dev/shm/latest.jpg"):
         self.config = config
-        self.output_path = Path(output_path)
-        self.tmp_path = self.output_path.with_suffix(".tmp.jpg")
+        self.output_path = output_path  # also sets tmp_path (see setter)
         self.last_capture_time = 0.0
+        # Persistent image2pipe stream (start_stream / stop_stream)
+        self._stream: Optional[subprocess.Popen] = None
+        self._buf = bytearray()
+
+    @property
+    def output_path(self) -> Path:
+        return self._output_path
+
+    @output_path.setter
+    def output_path(self, value):
+        # tmp 檔跟著輸出路徑放在同一目錄：os.replace 才是同一檔案系統上的原子 rename
+        # (cmd_snapshot 每張都會改 output_path)；字串形式先算好，capture 直接沿用
+        self._output_path = Path(value)
+        self.tmp_path = self._output_path.with_suffix(".tmp.jpg")
+        self._out_str = str(self._output_path)
+        self._tmp_str = str(self.tmp_path)
+
+    def start_stream(self, interval: float = 0.0):
+        """
+        Keep one FFmpeg (one connection, one decoder init) producing JPEGs on stdout for repeated capture() calls.
+        interval > 0 paces output with an fps filter; 0 passes every frame through.
+        """
+        if self._stream and self._stream.poll() is None:
+            return
+        vf = f"scale={self.config.scale}"
+        if interval > 0:
+            vf = f"fps={1.0 / interval},{vf}"
+        cmd = [
+            "/usr/bin/ffmpeg",
+            "-hide_banner", "-loglevel", "error",
+            "-rw_timeout", str(self.config.rw_timeout_us),
+            "-i", self.config.url,
+            "-an", "-sn", "-dn",
+            "-vf", vf,
+            "-q:v", str(self.config.quality),
+            "-f", "image2pipe", "-vcodec", "mjpeg",
+            "-"
+        ]
+        self._buf.clear()
+        self._stream = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def stop_stream(self):
+        if not self._stream:
+            return
+        self._stream.terminate()
+        try:
+            self._stream.wait(timeout=5.0)
+        except subprocess.TimeoutExpired:
+            self._stream.kill()
+            self._stream.wait()
+        self._stream.stdout.close()
+        self._stream = None
+
+    def _read_stream_frame(self) -> bytes:
+        """Next complete JPEG (SOI .. EOI) from the stream pipe"""
+        out = self._stream.stdout
+        while True:
+            start = self._buf.find(b"\xff\xd8")
+            if start >= 0:
+                # 0xFF in entropy-coded data is byte-stuffed, so FFD9 only appears as the real EOI
+                end = self._buf.find(b"\xff\xd9", start + 2)
+                if end >= 0:
+                    frame = bytes(self._buf[start:end + 2])
+                    del self._buf[:end + 2]
+                    return frame
+            chunk = out.read1(65536)
+            if not chunk:
+                raise CaptureError(f"FFmpeg stream ended (exit code {self._stream.poll()})")
+            self._buf += chunk
 
     def capture(self) -> str:
         """
-        同步執行一次 FFmpeg 截圖
+        同步執行一次 FFmpeg 截圖 (start_stream 之後改從常駐 FFmpeg 的 pipe 取下一張)
         Return: 截圖檔案路徑
         """
+        if self._stream:
+            try:
+                frame = self._read_stream_frame()
+                with open(self._tmp_str, "wb") as f:
+                    f.write(frame)
+                os.replace(self._tmp_str, self._out_str)
+                self.last_capture_time = time.time()
+                return self._out_str
+            except CaptureError:
+                raise
+            except Exception as e:
+                raise CaptureError(f"Capture failed: {e}")
+
         cmd = [
             "/usr/bin/ffmpeg",
             "-hide_banner", "-loglevel", "error", "-y",
@@ -33,17 +144,16 @@ class StreamCapturer:
             "-vf", f"scale={self.config.scale}",
             "-q:v", str(self.config.quality),
             "-f", "image2", "-vcodec", "mjpeg",
-            str(self.tmp_path)
+            self._tmp_str
         ]
 
         try:
-            start = time.time()
             subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
-            os.replace(self.tmp_path, self.output_path)
+            os.replace(self._tmp_str, self._out_str)
             self.last_capture_time = time.time()
-            return str(self.output_path)
+            return self._out_str
         except subprocess.CalledProcessError as e:
-            err = e.stderr.decode() if e.stderr else "unknown error"
+            err = _stderr_tail(e.stderr)
             raise CaptureError(f"FFmpeg failed: {err}")
         except Exception as e:
             raise CaptureError(f"Capture failed: {e}")
@@ -67,23 +177,34 @@ class PersistentCapturer:
     優點：只建立一次串流連線，減少 SRS on_play/on_stop 事件
     使用 FFmpeg -update 1 參數持續覆蓋同一檔案
     """
-    def __init__(self, config: StreamConfig, output_path: str, interval: float = 1.0):
+    def __init__(self, config: StreamConfig, output_path: str, interval: float = 1.0,
+                 gray_path: Optional[str] = None, atomic_writes: bool = False):
         self.config = config
         self.output_path = Path(output_path)
+        # 選用：同一個 FFmpeg 另外輸出灰階 PGM 給 detector (不需要 JPEG 解碼)
+        self.gray_path = Path(gray_path) if gray_path else None
+        # 選用：寫暫存檔再 rename，讀取端永遠拿到完整的 frame (需要 FFmpeg 支援 image2 -atomic_writing)
+        self.atomic_writes = atomic_writes
         self.interval = max(0.1, interval)  # 最小 0.1 秒
         self.process: Optional[subprocess.Popen] = None
         self._lock = threading.Lock()
         self._stop_requested = False
         self._restart_count = 0
         self._last_start_time = 0.0
+        # 設定在 capturer 生命週期內不變，命令只建一次 (重啟時直接沿用)
+        self._cmd = self._build_cmd()
+        # stderr 由背景 thread 持續讀掉 (否則 64K pipe 塞滿會卡住 FFmpeg)，只保留最後幾行供錯誤訊息使用
+        self._stderr_lines: deque = deque(maxlen=64)
+        self._stderr_thread: Optional[threading.Thread] = None
         
     def _build_cmd(self) -> list:
         """建構 FFmpeg 命令"""
         # fps filter: 1/interval = frames per second
         # 例如 interval=1.0 -> fps=1, interval=0.5 -> fps=2
         fps_value = 1.0 / self.interval
+        atomic = ["-atomic_writing", "1"] if self.atomic_writes else []
         
-        return [
+        cmd = [
             "/usr/bin/ffmpeg",
             "-hide_banner", "-loglevel", "warning",
             "-rw_timeout", str(self.config.rw_timeout_us),
@@ -93,9 +214,21 @@ class PersistentCapturer:
             "-q:v", str(self.config.quality),
             "-f", "image2",
             "-update", "1",  # 關鍵：持續覆蓋同一檔案
+            *atomic,
             "-y",
             str(self.output_path)
         ]
+        if self.gray_path:
+            # Second output from the same decoded frames: raw 8-bit gray PGM (header + W*H bytes)
+            cmd += [
+                "-vf", f"fps={fps_value},scale={self.config.scale},format=gray",
+                "-f", "image2", "-c:v", "pgm",
+                "-update", "1",
+                *atomic,
+                "-y",
+                str(self.gray_path)
+            ]
+        return cmd
         
     def start(self) -> bool:
         """啟動持久化 FFmpeg 進程"""
@@ -105,16 +238,20 @@ class PersistentCapturer:
                 return True
                 
             self._stop_requested = False
-            cmd = self._build_cmd()
             
             try:
-                print(f"[PersistentCapturer] Starting: {' '.join(cmd)}")
+                # 完整命令只在第一次啟動時印出；ensure_running 重啟時已經有自己的 log
+                if self._restart_count == 0:
+                    print(f"[PersistentCapturer] Starting: {' '.join(self._cmd)}")
                 self.process = subprocess.Popen(
-                    cmd,
+                    self._cmd,
                     stdout=subprocess.DEVNULL,
                     stderr=subprocess.PIPE,
                     text=True
                 )
+                self._stderr_lines.clear()
+                self._stderr_thread = threading.Thread(target=self._drain_stderr, args=(self.process,), daemon=True)
+                self._stderr_thread.start()
                 self._last_start_time = time.time()
                 print(f"[PersistentCapturer] Started with PID {self.process.pid}")
                 return True
@@ -122,6 +259,14 @@ class PersistentCapturer:
                 print(f"[PersistentCapturer] Failed to start: {e}")
                 return False
     
+    def _drain_stderr(self, proc: subprocess.Popen):
+        """Read the process's stderr until EOF (process exit), keeping only the last lines"""
+        try:
+            for line in proc.stderr:
+                self._stderr_lines.append(line.rstrip())
+        except (OSError, ValueError):
+            pass  # pipe closed
+
     def stop(self):
         """停止 FFmpeg 進程"""
         with self._lock:
@@ -156,16 +301,15 @@ class PersistentCapturer:
         # 進程已停止，檢查錯誤訊息
         with self._lock:
             if self.process:
-                stderr_output = ""
-                try:
-                    stderr_output = self.process.stderr.read() if self.process.stderr else ""
-                except:
-                    pass
+                # Drain thread hits EOF right after the exit; give it a moment to take the last lines
+                if self._stderr_thread:
+                    self._stderr_thread.join(timeout=1.0)
+                stderr_output = "\n".join(self._stderr_lines)
                     
                 exit_code = self.process.returncode
                 print(f"[PersistentCapturer] Process exited with code {exit_code}")
                 if stderr_output:
-                    print(f"[PersistentCapturer] Stderr: {stderr_output[:500]}")
+                    print(f"[PersistentCapturer] Stderr: {stderr_output[-500:]}")
                 self.process = None
         
         # 避免快速重啟循環
@@ -3,16 +3,21 @@ import sys
 import uvicorn
 import yaml
 import threading
+from collections import deque
 from pathlib import Path
 
 from .config import load_config
 from .detector import EgmStateDetector
 from .streamer import Streamer
 from .api import create_app
-from .capture import StreamCapturer, StreamConfig
+from .capture import StreamCapturer, StreamConfig, drop_page_cache
 from .refs import ReferenceManager
 from .matcher import Matcher
 
+# Burst frames get drop_page_cache twice: right after the write (starts async writeback) and again
+# this many frames later, when the pages are clean and can actually be dropped (no blocking fdatasync)
+DROP_CACHE_LAG = 32
+
 def cmd_serve(args):
     """Start API server, background detector, and background streamer"""
     config = load_config(args.config)
@@ -57,7 +62,10 @@ def cmd_detect(args):
     # Looking at detector.py, it accesses `config.stream`. Now it is `config.detector.capture`.
     # WE MUST UPDATE DETECTOR.PY as well! 
     # For now, let's fix CLI to pass valid config assuming detector is updated.
-    result = detector.step()
+    try:
+        result = detector.step()
+    finally:
+        detector.close()
     print(result.model_dump_json(indent=2))
 
 def cmd_snapshot(args):
@@ -67,33 +75,46 @@ def cmd_snapshot(args):
     capturer = StreamCapturer(sc, args.output_file or "/dev/shm/snap_manual.jpg")
     
     saved_paths = []
+    pending_drop = deque()
     print(f"Snapshotting from {args.url} ...")
     
     import time
-    import time
-    i = 0
-    while args.count <= 0 or i < args.count:
-        if args.output_dir:
-            ts = int(time.time() * 1000)
-            fname = f"snap_{ts}_{i:02d}.jpg"
-            path = Path(args.output_dir) / fname
-            capturer.output_path = path
-        
-        real_path = capturer.capture()
-        saved_paths.append(real_path)
-        print(f"Saved: {real_path}")
-        
-        # Don't sleep if running continuously and interval is 0
-        if (args.count <= 0 or i < args.count - 1) and args.interval > 0:
-            time.sleep(args.interval)
+    # More than one frame: one persistent FFmpeg (single connection) whose fps filter paces the burst
+    streaming = args.count != 1
+    if streaming:
+        capturer.start_stream(args.interval)
+    try:
+        i = 0
+        while args.count <= 0 or i < args.count:
+            if args.output_dir:
+                ts = int(time.time() * 1000)
+                fname = f"snap_{ts}_{i:02d}.jpg"
+                path = Path(args.output_dir) / fname
+                capturer.output_path = path
             
-        i += 1
+            real_path = capturer.capture()
+            if args.output_dir:
+                # Burst output is write-once: don't let a long run push useful pages out of the page cache
+                drop_page_cache(real_path)
+                pending_drop.append(real_path)
+                if len(pending_drop) > DROP_CACHE_LAG:
+                    drop_page_cache(pending_drop.popleft())
+            saved_paths.append(real_path)
+            print(f"Saved: {real_path}")
+            # No sleep here: a single frame needs none, and for bursts FFmpeg's fps filter paces frames
+            i += 1
+    finally:
+        capturer.stop_stream()
+        # Best effort: the newest frames may still be under writeback and keep their pages
+        for p in pending_drop:
+            drop_page_cache(p)
 
 def cmd_rebuild(args):
     """Force rebuild references"""
     config = load_config(args.config)
     # Update to use nested detector config
     ref_mgr = ReferenceManager(config.detector.states, config.detector.detection)
+    ref_mgr.invalidate_cache()
     ref_mgr.load_all()
     print("Rebuild complete.")
 
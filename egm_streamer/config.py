@@ -1,17 +1,22 @@
 import yaml
 from pathlib import Path
-from .models import AppConfig
+from typing import Dict, Set, Tuple
+from .models import AppConfig, ROI
+
+# libyaml C loader when PyYAML was built with it (same results as safe_load, much faster parse)
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
 def load_config(path: str) -> AppConfig:
     with open(path, "r", encoding="utf-8") as f:
-        data = yaml.safe_load(f)
+        data = yaml.load(f, Loader=_YamlLoader)
     
     # 轉換 states list to dict (方便 YAML 書寫)
     # 假設 YAML 裡的 states 還是 list of dict 比較好寫，這裡轉一下
     # 或是直接讓 YAML key 就是 state name
     
     # Post-process: Resolve linked ROIs (missing coords)
-    app_config = AppConfig(**data)
+    # model_validate hands the parsed dict to pydantic-core as is (no **kwargs re-packing)
+    app_config = AppConfig.model_validate(data)
     
     detector_cfg = app_config.detector
     states = detector_cfg.states
@@ -24,35 +29,47 @@ def load_config(path: str) -> AppConfig:
             if not p.is_absolute():
                 state_config.refs_dir = str(Path(base_refs_dir) / p)
 
-    # 2. Resolve linked ROIs
+    # 2. Resolve linked ROIs (has ref_state but missing coords), following chains A -> B -> C
+    # { state_name: { roi_name: ROI } } so each link is a dict lookup instead of a scan
+    rois_by_state = {name: {r.name: r for r in s.rois} for name, s in states.items()}
     for state_name, state_config in states.items():
-        for i, roi in enumerate(state_config.rois):
-            # Check if this is a linked ROI (has ref_state but missing coords)
-            if roi.ref_state and (roi.x is None or roi.y is None or roi.w is None or roi.h is None):
-                target_state_name = roi.ref_state
-                
-                # Check if target state exists
-                if target_state_name not in states:
-                    raise ValueError(f"State '{state_name}' ROI '{roi.name}' references unknown state '{target_state_name}'")
-                
-                target_state = states[target_state_name]
-                
-                # Find matching ROI in target state
-                target_roi = next((r for r in target_state.rois if r.name == roi.name), None)
-                
-                if not target_roi:
-                     raise ValueError(f"State '{state_name}' ROI '{roi.name}' references ROI '{roi.name}' in '{target_state_name}', but it does not exist")
-                
-                # Verify target has coordinates (recursive chain check ideally, but simple for now)
-                if target_roi.x is None:
-                     raise ValueError(f"Target ROI '{roi.name}' in '{target_state_name}' also has missing coordinates (chained linking not fully supported yet)")
-
-                # Copy coordinates
-                roi.x = target_roi.x
-                roi.y = target_roi.y
-                roi.w = target_roi.w
-                roi.h = target_roi.h
-                
-                # Note: We modified the ROI object in place within the list
+        for roi in state_config.rois:
+            _resolve_linked_roi(rois_by_state, state_name, roi, set())
 
     return app_config
+
+def _has_coords(roi: ROI) -> bool:
+    return not (roi.x is None or roi.y is None or roi.w is None or roi.h is None)
+
+def _resolve_linked_roi(rois_by_state: Dict[str, Dict[str, ROI]], state_name: str, roi: ROI, seen: Set[Tuple[str, str]]):
+    """
+    Copy coordinates into a linked ROI from the same-named ROI of its ref_state, resolving the target first.
+    Modifies ROI objects in place, so every ROI along a chain is resolved once (later lookups see coords).
+    """
+    if not roi.ref_state or _has_coords(roi):
+        return
+    if (state_name, roi.name) in seen:
+        raise ValueError(f"State '{state_name}' ROI '{roi.name}' is part of a circular ref_state link")
+    seen.add((state_name, roi.name))
+
+    target_state_name = roi.ref_state
+    
+    # Check if target state exists
+    if target_state_name not in rois_by_state:
+        raise ValueError(f"State '{state_name}' ROI '{roi.name}' references unknown state '{target_state_name}'")
+    
+    # Find matching ROI in target state
+    target_roi = rois_by_state[target_state_name].get(roi.name)
+    if not target_roi:
+        raise ValueError(f"State '{state_name}' ROI '{roi.name}' references ROI '{roi.name}' in '{target_state_name}', but it does not exist")
+    
+    # Chained link: resolve the target first
+    _resolve_linked_roi(rois_by_state, target_state_name, target_roi, seen)
+    if not _has_coords(target_roi):
+        raise ValueError(f"Target ROI '{roi.name}' in '{target_state_name}' also has missing coordinates and no ref_state to inherit them from")
+
+    # Copy coordinates
+    roi.x = target_roi.x
+    roi.y = target_roi.y
+    roi.w = target_roi.w
+    roi.h = target_roi.h
@@ -1,17 +1,21 @@
 import io
 import time
-import json
 import os
 from pathlib import Path
 from typing import Optional, Dict
 
-from PIL import Image
+import numpy as np
 
 from .models import AppConfig, DetectionResult, MatchResult
 from .refs import ReferenceManager
 from .matcher import Matcher
+from .hasher import load_gray, parse_pgm
 from .state_machine import StateMachine
 from .notifier import TelegramNotifier
+from .watch import FileWatcher
+
+# Step at least this often even without a new frame (picks up ref changes, keeps status fresh)
+FRAME_WAIT_TIMEOUT = 5.0
 
 
 class EgmStateDetector:
@@ -29,36 +33,80 @@ class EgmStateDetector:
         det_cfg = config.detector
         
         # Use snapshot service's output path for reading images
-        self.snapshot_path = Path(config.snapshot.output_path)
+        # (the grayscale PGM output when configured: no JPEG decode per step)
+        self.gray_path = Path(config.snapshot.gray_path) if config.snapshot.gray_path else None
+        self.snapshot_path = self.gray_path or Path(config.snapshot.output_path)
+        # Wakes the detection loop when the snapshot service writes a new frame
+        self.frame_watcher = FileWatcher(str(self.snapshot_path))
         if not config.snapshot.enabled:
             print("[Detector] WARNING: Snapshot service is disabled! Detector requires it to function.")
         
         self.ref_mgr = ReferenceManager(det_cfg.states, det_cfg.detection)
-        self.matcher = Matcher(self.ref_mgr, det_cfg.detection.algo, det_cfg.detection.hash_size)
+        self.matcher = Matcher(self.ref_mgr, det_cfg.detection.algo, det_cfg.detection.hash_size,
+                               det_cfg.detection.workers, det_cfg.detection.resize)
         self.sm = StateMachine(det_cfg.debounce)
         
+        # Match plans in priority order, built once: [(state_name, rois, policy), ...]
+        self._plans = [
+            (name, det_cfg.states[name].rois, det_cfg.states[name].match_policy)
+            for name in det_cfg.priority if name in det_cfg.states
+        ]
+        self._plan_index = {name: i for i, (name, _, _) in enumerate(self._plans)}
+        
         # Notifier
         self.notifier = TelegramNotifier(det_cfg.telegram, config.common.instance_id)
         self._last_state = "UNKNOWN"
         
+        # Latest status JSON (same bytes as the status file), served from memory by /api/state
+        self.last_status: Optional[bytes] = None
+        # (signature, monotonic time) of the last status file write: unchanged results are only refreshed periodically
+        self._status_sig: Optional[tuple] = None
+        self._status_written = 0.0
+        
+        # Last decoded frame, keyed by the file's (mtime_ns, size, inode):
+        # when the detector runs faster than the snapshot service, unchanged frames are not re-read/re-decoded
+        self._frame_key: Optional[tuple] = None
+        self._frame: Optional[np.ndarray] = None
+        
         # Initial load
         self.ref_mgr.load_all()
     
-    def _read_snapshot_image(self) -> Image.Image:
+    def _read_snapshot_image(self) -> np.ndarray:
         """
         Read the latest snapshot image produced by snapshot service.
         Uses atomic read to avoid reading a partial image during write.
+        Returns the frame decoded once as a grayscale uint8 array; ROIs are sliced from it.
+        The array is reused (read-only) until the file is rewritten.
         """
-        if not self.snapshot_path.exists():
-            raise FileNotFoundError(f"Snapshot file not found: {self.snapshot_path}")
-        
         # Read entire file into memory first (atomic read pattern)
-        with open(self.snapshot_path, "rb") as f:
-            data = f.read()
-        
-        img = Image.open(io.BytesIO(data))
-        img.load()  # Force decode to catch truncated images
-        return img.convert("L")  # Convert to grayscale
+        # os.open + fstat + one pread: no separate exists() probe, single buffer allocation.
+        # Not mmap: ffmpeg -update truncates and rewrites the file in place, and touching
+        # a mapping past the new EOF raises SIGBUS (kills the process).
+        try:
+            fd = os.open(self.snapshot_path, os.O_RDONLY)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Snapshot file not found: {self.snapshot_path}")
+        try:
+            st = os.fstat(fd)
+            key = (st.st_mtime_ns, st.st_size, st.st_ino)
+            if key == self._frame_key:
+                return self._frame
+            data = os.pread(fd, st.st_size, 0)
+        finally:
+            os.close(fd)
+        
+        if self.gray_path:
+            # Raw gray frame: just a view over the bytes (truncated files raise ValueError)
+            frame = parse_pgm(data)
+        else:
+            # Decode straight to grayscale (forces a full decode, so truncated images raise here)
+            frame = load_gray(io.BytesIO(data))
+            frame.flags.writeable = False
+        
+        # Only cached once decoding succeeded: a partial write is retried on the next step
+        self._frame_key = key
+        self._frame = frame
+        return frame
 
     def step(self) -> DetectionResult:
         """執行一次完整的偵測流程"""
@@ -80,18 +128,33 @@ class EgmStateDetector:
                 timestamp=time.time()
             )
 
-        # 2. Match all states (collect results first, then decide)
-        det_cfg = self.config.detector
-        
-        for state_name in det_cfg.priority:
-            state_cfg = det_cfg.states.get(state_name)
-            if not state_cfg: 
+        # 2. Match states (collect results first, then decide)
+        #    States are scored in batched XOR/popcount passes
+        plans = self._plans
+
+        # 穩定狀態通常會延續到下一個 frame：先只比對目前狀態以及優先權比它高的狀態，
+        # 其中有命中的話，優先權更低的狀態不可能勝出，直接跳過；都沒命中才補比剩下的
+        head = plans
+        cur_idx = self._plan_index.get(self.sm.current_state)
+        if cur_idx is not None:
+            head = plans[:cur_idx + 1]
+        results = self.matcher.match_states(img, head)
+        if len(head) < len(plans) and not any(r[0] for r in results.values()):
+            results.update(self.matcher.match_states(img, plans[len(head):]))
+
+        for state_name, _, _ in plans:
+            if state_name not in results:
+                # Skipped by the short-circuit above, or unmatchable with its current refs (not hashed);
+                # still listed so consumers see every state
+                matches_summary[state_name] = MatchResult(
+                    state=state_name,
+                    matched_rois=[],
+                    avg_distance=-1.0,
+                    is_match=False,
+                    skipped=True
+                )
                 continue
-                
-            is_match, matched_rois, avg_dist = self.matcher.match_state(
-                img, state_name, state_cfg.rois, state_cfg.match_policy
-            )
-            
+            is_match, matched_rois, avg_dist = results[state_name]
             matches_summary[state_name] = MatchResult(
                 state=state_name,
                 matched_rois=matched_rois,
@@ -101,20 +164,8 @@ class EgmStateDetector:
         
         # 3. Choose best candidate by PRIORITY order
         #    Priority: [SELECT, PLAYING, NORMAL] - first match wins
-        
-        best_candidate = "OTHER"
-        
-        # Collect all matching states
-        matching_states = set()
-        for state_name, match_result in matches_summary.items():
-            if match_result.is_match:
-                matching_states.add(state_name)
-        
-        # Simply choose by priority order - higher priority always wins
-        for state_name in det_cfg.priority:
-            if state_name in matching_states:
-                best_candidate = state_name
-                break
+        #    (results are already in priority order: plans are, and the tail pass is appended after the head)
+        best_candidate = next((name for name, r in results.items() if r[0]), "OTHER")
 
         # 4. State Machine Update
         final_state = self.sm.update(best_candidate)
@@ -140,25 +191,51 @@ class EgmStateDetector:
         return result
 
     def _write_status(self, res: DetectionResult):
-        path = self.config.detector.output.status_file
+        data = res.model_dump_json().encode("utf-8")
+        self.last_status = data
+        
+        out_cfg = self.config.detector.output
+        sig = (res.state, tuple((k, m.is_match, round(m.avg_distance, 1)) for k, m in res.matches.items()))
+        now = time.monotonic()
+        if sig == self._status_sig and now - self._status_written < out_cfg.refresh_interval:
+            return
+        
+        path = out_cfg.status_file
         try:
             tmp = path + ".tmp"
-            with open(tmp, "w", encoding="utf-8") as f:
-                f.write(res.model_dump_json())
+            # One unbuffered write of the already-encoded bytes (no file object / buffer layer)
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
             os.replace(tmp, path)
+            self._status_sig = sig
+            self._status_written = now
         except Exception as e:
             print(f"[Error] Write status failed: {e}")
 
+    def close(self):
+        """Release the inotify fd / watches and the hashing pool; safe to call more than once"""
+        self.frame_watcher.close()
+        self.matcher.close()
+
     def run_forever(self):
         interval = self.config.detector.capture.capture_interval
         print(f"Starting detection loop. Interval={interval}s")
-        while True:
-            t0 = time.time()
-            res = self.step()
-            
-            # Log change (optional)
-            # print(f"State: {res.state}")
-            
-            dt = time.time() - t0
-            sleep_time = max(0, interval - dt)
-            time.sleep(sleep_time)
+        try:
+            while True:
+                t0 = time.monotonic()
+                res = self.step()
+                
+                # Log change (optional)
+                # print(f"State: {res.state}")
+                
+                dt = time.monotonic() - t0
+                sleep_time = max(0, interval - dt)
+                time.sleep(sleep_time)
+                
+                # capture_interval is the minimum spacing; then wait for a fresh frame instead of re-matching the old one
+                self.frame_watcher.wait(FRAME_WAIT_TIMEOUT)
+        finally:
+            self.close()
@@ -1,19 +1,139 @@
-from PIL import Image
-from typing import List, Tuple
-import imagehash
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple, Dict, Sequence
+import numpy as np
 from .models import ROI, MatchPolicy
 from .refs import ReferenceManager
-from .hasher import compute_hash
+from .hasher import compute_hash, hamming_distances
 
 class Matcher:
-    def __init__(self, ref_mgr: ReferenceManager, algo: str = "dhash", hash_size: int = 8):
+    def __init__(self, ref_mgr: ReferenceManager, algo: str = "dhash", hash_size: int = 8, workers: int = 1, resize: str = "lanczos"):
         self.ref_mgr = ref_mgr
         self.algo = algo
         self.hash_size = hash_size
+        self.resize = resize
+        # Content-addressed ROI hash cache: (blake2b(crop), shape) -> packed hash
+        self._hash_cache: "OrderedDict[Tuple[bytes, Tuple[int, ...]], np.ndarray]" = OrderedDict()
+        self._hash_cache_size = 256
+        # Optional pool for batched ROI hashing (PIL resize and the NumPy kernels release the GIL)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="roi-hash") if workers > 1 else None
 
-    def match_state(self, img: Image.Image, state_name: str, rois: List[ROI], policy: MatchPolicy) -> Tuple[bool, List[str], float]:
+    def close(self):
+        """Stop the hashing pool (idempotent)"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    @staticmethod
+    def _crop(img: np.ndarray, roi: ROI) -> np.ndarray:
+        # Crop (zero-copy view)
+        return img[roi.y:roi.y + roi.h, roi.x:roi.x + roi.w]
+
+    @staticmethod
+    def _cache_key(cropped: np.ndarray) -> Tuple[bytes, Tuple[int, ...]]:
+        return hashlib.blake2b(np.ascontiguousarray(cropped), digest_size=16).digest(), cropped.shape
+
+    def _cache_get(self, key) -> Optional[np.ndarray]:
+        h = self._hash_cache.get(key)
+        if h is not None:
+            self._hash_cache.move_to_end(key)
+        return h
+
+    def _cache_put(self, key, h: np.ndarray) -> None:
+        self._hash_cache[key] = h
+        if len(self._hash_cache) > self._hash_cache_size:
+            self._hash_cache.popitem(last=False)
+
+    def _roi_hash(self, img: np.ndarray, roi: ROI) -> np.ndarray:
+        cropped = self._crop(img, roi)
+
+        # 靜態 ROI (logo / UI) 在連續 frame 之間內容常常完全相同：
+        # 先對 crop 做 blake2b 指紋，命中就跳過 resize + perceptual hash
+        key = self._cache_key(cropped)
+        h = self._cache_get(key)
+        if h is None:
+            h = compute_hash(cropped, self.algo, self.hash_size, self.resize)
+            self._cache_put(key, h)
+        return h
+
+    def _roi_hashes(self, img: np.ndarray, rois: Sequence[ROI]) -> List[np.ndarray]:
+        """Hash several ROIs of one frame; cache misses go to the worker pool when one is configured"""
+        if self._pool is None:
+            return [self._roi_hash(img, roi) for roi in rois]
+
+        crops = [self._crop(img, roi) for roi in rois]
+        keys = [self._cache_key(c) for c in crops]
+        hashes = [self._cache_get(k) for k in keys]
+        # Cache is only touched from this thread; workers just run compute_hash
+        misses = [i for i, h in enumerate(hashes) if h is None]
+        if misses:
+            computed = self._pool.map(lambda c: compute_hash(c, self.algo, self.hash_size, self.resize), [crops[i] for i in misses])
+            for i, h in zip(misses, computed):
+                hashes[i] = h
+                self._cache_put(keys[i], h)
+        return hashes
+
+    def match_states(self, img: np.ndarray, plans: Sequence[Tuple[str, List[ROI], MatchPolicy]]) -> Dict[str, Tuple[bool, List[str], float]]:
+        """
+        一次比對多個狀態
+        所有 (state, ROI) 的 refs 合併成一個矩陣，整個 frame 只做一次 XOR/popcount，
+        再用 np.minimum.reduceat 取出每個 ROI 的最小距離
+        plans: [(state_name, rois, policy), ...]
+        Return: { state_name: (is_match, matched_roi_names, avg_distance) }
+        States that cannot match whatever the frame shows are not hashed and are left out of the result
+        (the detector reports missing states as skipped)
         """
-        比對單一狀態
+        slots = [(state_name, roi) for state_name, rois, _ in plans for roi in rois]
+        keys = tuple((roi.ref_state if roi.ref_state else state_name, roi.name) for state_name, roi in slots)
+        refs_all, owner, counts = self.ref_mgr.get_packed_concat(keys)
+
+        min_dists = np.full(len(slots), -1, dtype=np.int64)
+        has_refs = counts > 0
+
+        # 結果在 hash 之前就已確定為 False 的狀態 (同 _decide 的規則)：
+        # required ROI 沒有 refs，或有 refs 的一般 ROI 數不足 min_match -> 不必 hash 它的 ROI
+        hopeless: List[bool] = []
+        live = np.zeros(len(slots), dtype=bool)
+        i = 0
+        for state_name, rois, policy in plans:
+            n = len(rois)
+            rows = has_refs[i:i + n].tolist()
+            fixed = (any(roi.required and not r for roi, r in zip(rois, rows))
+                     or sum(1 for roi, r in zip(rois, rows) if r and not roi.negative) < policy.min_match)
+            hopeless.append(fixed)
+            if not fixed:
+                live[i:i + n] = rows
+            i += n
+
+        if live.any():
+            # Only hash ROIs that have refs to compare against (rows of hopeless states are never read)
+            cur = np.zeros((len(slots), refs_all.shape[1]), dtype=np.uint64)
+            # 同一個 frame 內座標相同的 ROI (e.g. 用 ref_state 連結的 ROI) 只 hash 一次
+            by_box: Dict[Tuple[int, int, int, int], List[int]] = {}
+            for i in np.flatnonzero(live):
+                roi = slots[i][1]
+                by_box.setdefault((roi.x, roi.y, roi.w, roi.h), []).append(i)
+            hashes = self._roi_hashes(img, [slots[rows[0]][1] for rows in by_box.values()])
+            for rows, h in zip(by_box.values(), hashes):
+                cur[rows] = h
+            dists = hamming_distances(refs_all, cur[owner])
+            starts = (np.cumsum(counts) - counts)[has_refs]
+            min_dists[has_refs] = np.minimum.reduceat(dists, starts)
+
+        results = {}
+        i = 0
+        for (state_name, rois, policy), fixed in zip(plans, hopeless):
+            n = len(rois)
+            # Hopeless states were never hashed: no distances to report, so leave them out
+            if not fixed:
+                results[state_name] = self._decide(state_name, rois, policy, min_dists[i:i + n].tolist())
+            i += n
+        return results
+
+    def _decide(self, state_name: str, rois: List[ROI], policy: MatchPolicy, min_dists: Sequence[int]) -> Tuple[bool, List[str], float]:
+        """
+        依每個 ROI 的最小距離判斷狀態是否成立 (min_dist < 0 表示該 ROI 沒有 refs)
         Return: (is_match, matched_roi_names, avg_distance)
         """
         matched_rois = []
@@ -23,30 +143,16 @@ class Matcher:
         
         required_missed = False
 
-        for roi in rois:
-            # Crop
-            cropped = img.crop((roi.x, roi.y, roi.x + roi.w, roi.y + roi.h))
-            current_hash = compute_hash(cropped, self.algo, self.hash_size)
-            
-            # Get refs (Use specific state if defined, else current state)
-            target_ref_state = roi.ref_state if roi.ref_state else state_name
-            refs = self.ref_mgr.get_hashes(target_ref_state, roi.name)
-            
-            if not refs:
+        for roi, min_dist in zip(rois, min_dists):
+            if min_dist < 0:
                 # No refs - can't calculate distance
                 if roi.required:
                     required_missed = True
                 continue
 
-            # Find min distance
-            min_dist = float('inf')
-            for r in refs:
-                dist = current_hash - r
-                if dist < min_dist:
-                    min_dist = dist
-            
             # Debug negative ROI
             if roi.negative:
+                target_ref_state = roi.ref_state if roi.ref_state else state_name
                 print(f"[Matcher] State:{state_name} ROI:{roi.name} IsNegative:True TargetRef:{target_ref_state} MinDist:{min_dist} Thresh:{policy.threshold}")
 
             # Track all distances for averaging
@@ -41,8 +41,11 @@ class StreamConfig(BaseModel):
 class DetectionConfig(BaseModel):
     algo: Literal["phash", "dhash", "ahash"] = "dhash"
     hash_size: int = 8
+    resize: Literal["lanczos", "box"] = "lanczos"  # hash downscale filter (box = area averaging, faster)
     samples: int = 3
     sample_interval: float = 0.15
+    workers: int = 1  # ROI hashing threads for the batched matcher (1 = inline, no pool)
+    ref_cache: Optional[str] = None  # .npz file persisting ref hashes across restarts (None = disabled)
 
 class DebounceConfig(BaseModel):
     confirm_frames: int = 2
@@ -50,12 +53,14 @@ class DebounceConfig(BaseModel):
 
 class OutputConfig(BaseModel):
     status_file: str = "/dev/shm/state.json"
+    refresh_interval: float = 1.0  # unchanged status is rewritten at most this often, seconds (0 = every step)
 
 class ApiConfig(BaseModel):
     host: str = "0.0.0.0"
     port: int = 8080
 
 class FFmpegParams(BaseModel):
+    encoder: Literal["libx264", "h264_nvenc", "h264_v4l2m2m"] = "libx264"  # hardware encoders move encoding off the CPU
     preset: str = "ultrafast"
     tune: str = "zerolatency"
     gop: int = 30
@@ -107,6 +112,8 @@ class SnapshotServiceConfig(BaseModel):
     output_path: str = "/dev/shm/latest.jpg"
     interval: float = 1.0
     quality: int = 2 # FFmpeg -q:v
+    gray_path: Optional[str] = None # Optional extra grayscale PGM output; detector reads it instead of decoding the JPEG
+    atomic_writes: bool = False # Write frames to a temp file + rename (FFmpeg image2 -atomic_writing); readers never see a partial frame
 
 class AppConfig(BaseModel):
     common: CommonConfig = Field(default_factory=CommonConfig)
@@ -122,6 +129,7 @@ class MatchResult(BaseModel):
     matched_rois: List[str]
     avg_distance: float
     is_match: bool
+    skipped: bool = False  # Not evaluated this frame (a higher-priority state already matched, or it can't match with the current refs)
 
 class DetectionResult(BaseModel):
     state: str
@@ -1,6 +1,8 @@
+import queue
 import threading
 import requests
 import time
+from typing import Optional
 from .models import TelegramConfig
 
 class TelegramNotifier:
@@ -8,6 +10,10 @@ class TelegramNotifier:
         self.config = config
         self.instance_id = config.client_id if config.client_id else instance_id
         self._running = True
+        # 單一背景 worker 依序送出 (共用 keep-alive HTTPS 連線)；queue 滿了就丟棄，不拖慢偵測迴圈
+        self._queue: "queue.Queue[str]" = queue.Queue(maxsize=16)
+        self._session = requests.Session()
+        self._worker: Optional[threading.Thread] = None
         
     def send_state_change(self, prev_state: str, new_state: str):
         if not self.config.enabled or not self.config.bot_token or not self.config.chat_id:
@@ -34,9 +40,18 @@ class TelegramNotifier:
             f"<code>{self.instance_id}</code> | {time.strftime('%H:%M:%S')}"
         )
         
-        # Fire and forget thread
-        t = threading.Thread(target=self._send, args=(msg,))
-        t.start()
+        # Fire and forget: hand off to the worker thread (started on first use)
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run_worker, daemon=True)
+            self._worker.start()
+        try:
+            self._queue.put_nowait(msg)
+        except queue.Full:
+            print(f"[Notifier] Queue full, dropping notification: {new_state}")
+        
+    def _run_worker(self):
+        while True:
+            self._send(self._queue.get())
         
     def _send(self, text: str):
         try:
@@ -46,7 +61,7 @@ class TelegramNotifier:
                 "text": text,
                 "parse_mode": "HTML"
             }
-            resp = requests.post(url, json=payload, timeout=5)
+            resp = self._session.post(url, json=payload, timeout=5)
             if not resp.ok:
                 print(f"[Notifier] TG Send failed: {resp.text}")
         except Exception as e:
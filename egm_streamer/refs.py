@@ -1,13 +1,24 @@
 import os
 import json
-import glob
+import time
 from pathlib import Path
-from typing import List, Dict, Optional
-from PIL import Image
+from typing import List, Dict, Optional, Tuple
+import numpy as np
 import imagehash
 
 from .models import StateConfig, ROI, DetectionConfig
-from .hasher import compute_hash, hex_to_hash
+from .hasher import compute_hash, hash_words, unpack_hash, load_gray
+
+_IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# 磁碟上 ref hash cache 的格式版本；解碼 / hash 邏輯改變時要遞增，舊 cache 會自動作廢
+_CACHE_VERSION = 2  # 2: phash back on scipy DCT (bit-identical to imagehash)
+
+# reload_if_needed 最多每隔幾秒才掃描一次 refs 目錄 (detector 每個 step 都會呼叫)
+REFS_CHECK_INTERVAL = 1.0
+
+# Per-file hash cache entry: ((st_mtime_ns, st_size), { (x, y, w, h): packed hash })
+_FileEntry = Tuple[Tuple[int, int], Dict[Tuple[int, int, int, int], np.ndarray]]
 
 class ReferenceManager:
     """管理參考圖片的 Hash Cache，避免每次重新讀圖計算"""
@@ -15,21 +26,44 @@ class ReferenceManager:
     def __init__(self, states: Dict[str, StateConfig], detection_config: DetectionConfig):
         self.states = states
         self.cfg = detection_config
-        # Cache structure: { state_name: { roi_name: [ImageHash, ...] } }
-        self.caches: Dict[str, Dict[str, List[imagehash.ImageHash]]] = {}
+        # Cache structure: { (state_name, roi_name): uint64[n_refs, words] } (C-contiguous, one row per ref)
+        self.packed: Dict[Tuple[str, str], np.ndarray] = {}
+        self._empty = np.empty((0, hash_words(self.cfg.hash_size)), dtype=np.uint64)
+        # get_packed_concat 結果快取，refs 重新載入時清空
+        self._concat_cache: Dict[Tuple[Tuple[str, str], ...], Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
         self.mtimes: Dict[str, float] = {}  # 用來偵測目錄更新
+        self._last_check = 0.0  # monotonic time of the last reload_if_needed scan
+        # 每個 ref 檔案、每個 ROI 範圍的 hash；只有新增 / 變更的檔案才需要重新解碼
+        # (persisted to detection.ref_cache when set, so restarts skip decoding entirely)
+        self._file_hashes: Dict[str, _FileEntry] = {}
+        self._cache_dirty = False
+        self._load_cache()
 
     def load_all(self):
         """載入所有狀態的參考圖片"""
         print(f"[RefMgr] Loading references for states: {list(self.states.keys())}")
         for name, config in self.states.items():
             self._load_state_refs(name, config)
+        # 全部狀態載完才寫一次 cache (每個狀態各寫一次會把整個 npz 重寫 N 次)
+        self._save_cache()
+
+    def reload_state(self, state_name: str):
+        """Rescan one state's refs dir now (after adding / deleting a ref); unchanged files reuse their hashes"""
+        self.mtimes.pop(state_name, None)
+        self._load_state_refs(state_name, self.states[state_name])
+        self._save_cache()
+
+    def invalidate_cache(self):
+        """Forget all per-file hashes (memory and disk cache), forcing the next load to re-decode every ref"""
+        self._file_hashes.clear()
+        self.mtimes.clear()
+        self._cache_dirty = True
 
     def _load_state_refs(self, state_name: str, config: StateConfig):
         ref_dir = Path(config.refs_dir)
         if not ref_dir.exists():
             print(f"[WARN] Refs dir not found: {ref_dir}")
-            self.caches[state_name] = {}
+            self._drop_state(state_name)
             return
 
         # 檢查 mtime 是否變更
@@ -39,43 +73,164 @@ class ReferenceManager:
 
         print(f"[RefMgr] (Re)loading refs for {state_name} from {ref_dir}")
         
-        # 載入所有圖片
-        files = sorted(glob.glob(str(ref_dir / "*")))
-        images = []
-        for f in files:
-            if f.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')):
+        # 逐檔比對 (mtime, size)，只有新檔或變更過的檔案才解碼 + 計算 hash
+        # One scandir pass (order doesn't matter: only the min distance over refs is used)
+        with os.scandir(ref_dir) as it:
+            images = [e for e in it if e.name.lower().endswith(_IMAGE_EXTS) and e.is_file()]
+        files = [e.path for e in images]
+        geoms = [(roi.x, roi.y, roi.w, roi.h) for roi in config.rois]
+        entries = []
+        decoded = 0
+        for e in images:
+            f = e.path
+            try:
+                st = e.stat()
+            except OSError:
+                continue
+            stamp = (st.st_mtime_ns, st.st_size)
+            entry = self._file_hashes.get(f)
+            if entry is None or entry[0] != stamp:
+                entry = (stamp, {})
+                self._file_hashes[f] = entry
+            hashes = entry[1]
+            missing = [g for g in geoms if g not in hashes]
+            if missing:
                 try:
-                    img = Image.open(f).convert("L")
-                    images.append(img)
+                    img = load_gray(f)
                 except Exception as e:
                     print(f"[WARN] Bad image {f}: {e}")
+                    continue
+                for x, y, w, h in missing:
+                    hashes[(x, y, w, h)] = compute_hash(img[y:y + h, x:x + w], self.cfg.algo, self.cfg.hash_size, self.cfg.resize)
+                decoded += 1
+                self._cache_dirty = True
+            entries.append(hashes)
+
+        # 移除已經不存在的檔案
+        dir_str = str(ref_dir)
+        current = set(files)
+        for f in [f for f in self._file_hashes if os.path.dirname(f) == dir_str and f not in current]:
+            del self._file_hashes[f]
+            self._cache_dirty = True
 
-        # 對每個 ROI 計算 Hash
-        state_cache = {}
-        for roi in config.rois:
-            hashes = []
-            for img in images:
-                cropped = img.crop((roi.x, roi.y, roi.x + roi.w, roi.y + roi.h))
-                h = compute_hash(cropped, self.cfg.algo, self.cfg.hash_size)
-                hashes.append(h)
-            state_cache[roi.name] = hashes
+        # 對每個 ROI 組成 Hash 矩陣
+        # 直接寫入預先配置的 uint64 矩陣，matcher 每個 ROI 只需一次 XOR/popcount
+        words = hash_words(self.cfg.hash_size)
+        self._drop_state(state_name)
+        for roi, geom in zip(config.rois, geoms):
+            mat = np.empty((len(entries), words), dtype=np.uint64)
+            for i, hashes in enumerate(entries):
+                mat[i] = hashes[geom]
+            self.packed[(state_name, roi.name)] = mat
         
-        self.caches[state_name] = state_cache
         self.mtimes[state_name] = current_mtime
-        print(f"  Loaded {len(images)} refs, {len(config.rois)} ROIs")
+        print(f"  Loaded {len(entries)} refs ({decoded} decoded), {len(config.rois)} ROIs")
+
+    def _cache_meta(self) -> List[str]:
+        return [str(_CACHE_VERSION), self.cfg.algo, str(self.cfg.hash_size), self.cfg.resize]
+
+    def _load_cache(self):
+        """Load per-file ref hashes saved by _save_cache (ignored if missing, stale or unreadable)"""
+        path = self.cfg.ref_cache
+        if not path or not os.path.exists(path):
+            return
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                if z["meta"].tolist() != self._cache_meta():
+                    print(f"[RefMgr] Ref hash cache {path} is for different hash settings, rebuilding")
+                    return
+                files = z["files"].tolist()
+                stamps = z["stamps"].tolist()
+                for f, stamp in zip(files, stamps):
+                    self._file_hashes[f] = (tuple(stamp), {})
+                for fi, geom, row in zip(z["entry_file"].tolist(), z["entry_geom"].tolist(), z["entry_hash"]):
+                    self._file_hashes[files[fi]][1][tuple(geom)] = row
+        except Exception as e:
+            print(f"[WARN] Ref hash cache {path} unreadable, rebuilding: {e}")
+            self._file_hashes.clear()
+            return
+        print(f"[RefMgr] Loaded ref hash cache: {len(self._file_hashes)} files")
+
+    def _save_cache(self):
+        path = self.cfg.ref_cache
+        if not path or not self._cache_dirty:
+            return
+        files = list(self._file_hashes)
+        entry_file, entry_geom, entry_hash = [], [], []
+        for fi, f in enumerate(files):
+            for geom, row in self._file_hashes[f][1].items():
+                entry_file.append(fi)
+                entry_geom.append(geom)
+                entry_hash.append(row)
+        words = hash_words(self.cfg.hash_size)
+        try:
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as fp:
+                np.savez(
+                    fp,
+                    meta=np.array(self._cache_meta()),
+                    files=np.array(files, dtype=str),
+                    stamps=np.array([self._file_hashes[f][0] for f in files], dtype=np.int64).reshape(-1, 2),
+                    entry_file=np.array(entry_file, dtype=np.int64),
+                    entry_geom=np.array(entry_geom, dtype=np.int64).reshape(-1, 4),
+                    entry_hash=np.array(entry_hash, dtype=np.uint64).reshape(-1, words),
+                )
+            os.replace(tmp, path)
+            self._cache_dirty = False
+        except Exception as e:
+            print(f"[WARN] Write ref hash cache failed: {e}")
 
     def _get_dir_mtime(self, p: Path) -> float:
+        """
+        Newest mtime of the refs dir itself and the files in it (one scandir pass).
+        The dir's own mtime moves on add / delete / rename, so deleted refs are noticed too.
+        """
         try:
-            return max(f.stat().st_mtime for f in p.glob("*") if f.is_file())
-        except ValueError:
+            with os.scandir(p) as it:
+                return max([os.stat(p).st_mtime] + [e.stat().st_mtime for e in it if e.is_file()])
+        except FileNotFoundError:
             return 0.0
 
+    def _drop_state(self, state_name: str):
+        for key in [k for k in self.packed if k[0] == state_name]:
+            del self.packed[key]
+        self._concat_cache.clear()
+
+    def get_packed(self, state_name: str, roi_name: str) -> np.ndarray:
+        """Packed reference hashes: uint64[n_refs, words] (empty matrix if none)"""
+        return self.packed.get((state_name, roi_name), self._empty)
+
+    def get_packed_concat(self, keys: Tuple[Tuple[str, str], ...]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        將多個 (state, roi) 的 refs 串成單一矩陣，供整個 frame 一次 XOR/popcount
+        Return: (refs_all uint64[N, words], owner int[N] (每列屬於 keys 的第幾個), counts int[len(keys)])
+        """
+        cached = self._concat_cache.get(keys)
+        if cached is None:
+            mats = [self.get_packed(state_name, roi_name) for state_name, roi_name in keys]
+            counts = np.array([len(m) for m in mats], dtype=np.intp)
+            refs_all = np.concatenate(mats) if mats else self._empty
+            owner = np.repeat(np.arange(len(keys), dtype=np.intp), counts)
+            cached = (refs_all, owner, counts)
+            self._concat_cache[keys] = cached
+        return cached
+
     def get_hashes(self, state_name: str, roi_name: str) -> List[imagehash.ImageHash]:
-        return self.caches.get(state_name, {}).get(roi_name, [])
+        """Backward compatible accessor; the matcher uses get_packed"""
+        return [unpack_hash(row, self.cfg.hash_size) for row in self.get_packed(state_name, roi_name)]
 
     def reload_if_needed(self):
         """定期呼叫此方法檢查是否有新的參考圖"""
+        now = time.monotonic()
+        if now - self._last_check < REFS_CHECK_INTERVAL:
+            return
+        self._last_check = now
+
+        # States sharing a refs_dir share one scan
+        scanned: Dict[str, float] = {}
         for name, config in self.states.items():
-            current_mtime = self._get_dir_mtime(Path(config.refs_dir))
-            if current_mtime > self.mtimes.get(name, 0):
+            if config.refs_dir not in scanned:
+                scanned[config.refs_dir] = self._get_dir_mtime(Path(config.refs_dir))
+            if scanned[config.refs_dir] > self.mtimes.get(name, 0):
                 self._load_state_refs(name, config)
+        self._save_cache()  # no-op unless some state re-hashed files
@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Optional
 from .models import DebounceConfig
 
 class StateMachine:
@@ -7,8 +7,11 @@ class StateMachine:
         self.current_state = "OTHER"
         
         # Counters
-        self.streaks: Dict[str, int] = {}  # 連續命中計數
-        self.none_streak = 0               # 連續不命中計數
+        # 每次命中都會把其他狀態歸零, 所以同一時間最多只有一個非零 streak,
+        # 用 (state, count) 一組就夠了, 不需要 dict
+        self.streak_state: Optional[str] = None  # 目前累積中的狀態
+        self.streak = 0                          # 連續命中計數
+        self.none_streak = 0                     # 連續不命中計數
 
     def update(self, detected_state: str) -> str:
         """
@@ -18,27 +21,26 @@ class StateMachine:
         
         # 1. Update streaks
         if detected_state != "OTHER":
-            self.streaks[detected_state] = self.streaks.get(detected_state, 0) + 1
-            self.none_streak = 0
-            
-            # Reset other streaks ?? 
             # 策略：如果同時有多個狀態命中（雖然 Detector 通常會選一個優先），
-            # 這裡只處理單一輸入。所以把其他非 detected_state 的計數歸零比較安全，
-            # 避免跳來跳去累積
-            for s in list(self.streaks.keys()):
-                if s != detected_state:
-                    self.streaks[s] = 0
+            # 這裡只處理單一輸入。換了狀態就從 1 重新累積，避免跳來跳去累積
+            if detected_state == self.streak_state:
+                self.streak += 1
+            else:
+                self.streak_state = detected_state
+                self.streak = 1
+            self.none_streak = 0
         else:
             self.none_streak += 1
-            # 沒命中時，所有命中 streak 歸零
-            self.streaks.clear()
+            # 沒命中時，命中 streak 歸零
+            self.streak_state = None
+            self.streak = 0
 
         # 2. State Transition Logic
         
         # case A: 當前是 OTHER，想要切換到某個有效狀態
         if self.current_state == "OTHER":
             if detected_state != "OTHER":
-                if self.streaks[detected_state] >= self.config.confirm_frames:
+                if self.streak >= self.config.confirm_frames:
                     self.current_state = detected_state
         
         # case B: 當前是某個有效狀態 (e.g. NORMAL)
@@ -49,7 +51,7 @@ class StateMachine:
             elif detected_state != "OTHER":
                 # 偵測到另一個有效狀態 (e.g. NORMAL -> SELECT)
                 # 必須等新狀態累積足夠
-                if self.streaks[detected_state] >= self.config.confirm_frames:
+                if self.streak >= self.config.confirm_frames:
                     self.current_state = detected_state
             else:
                 # 瞬間變成 OTHER (掉偵測)
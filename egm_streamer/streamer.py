@@ -2,13 +2,16 @@ import os
 import time
 import subprocess
 import threading
-import signal
 import re
 from pathlib import Path
 from typing import Optional, List
 
 from .models import StreamerConfig, StreamStatus
 
+# Status file is rewritten at most this often (ffmpeg emits a progress block every ~0.5s);
+# the API serves self.status from memory, so only external readers see the file
+STATUS_WRITE_INTERVAL = 1.0
+
 class Streamer:
     def __init__(self, name: str, config: StreamerConfig):
         self.name = name
@@ -20,6 +23,10 @@ class Streamer:
             running=False, pid=None, fps=0.0, bitrate="0", uptime=0.0, last_update=0.0
         )
         self.start_time = 0.0
+        self._status_written = 0.0  # monotonic time of the last status file write
+        # 設定在 streamer 生命週期內不變，命令只建一次 (重啟時直接沿用)
+        self._cmd: Optional[List[str]] = self._build_cmd() if config.rtmp_url else None
+        self._starts = 0
 
     def start(self):
         """Start the streamer in a background thread"""
@@ -28,12 +35,17 @@ class Streamer:
         self.thread.start()
 
     def stop(self):
-        """Stop the streamer"""
+        """Stop the streamer: terminate FFmpeg (escalating to kill) and reap it, then join the loop thread"""
         self.stop_event.set()
-        if self.process:
+        proc = self.process
+        if proc and proc.poll() is None:
             try:
-                os.kill(self.process.pid, signal.SIGTERM)
-                # self.process.wait(timeout=3.0) 
+                proc.terminate()
+                proc.wait(timeout=3.0)
+            except subprocess.TimeoutExpired:
+                print(f"[Streamer:{self.name}] Force killing FFmpeg PID {proc.pid}")
+                proc.kill()
+                proc.wait()
             except Exception:
                 pass
         if hasattr(self, 'thread'):
@@ -48,14 +60,12 @@ class Streamer:
             
             if not self.stop_event.is_set():
                 print(f"[Streamer:{self.name}] Restarting in 3 seconds...")
-                time.sleep(3)
-
-    def _run_ffmpeg(self):
-        if not self.config.rtmp_url:
-            print(f"[Streamer:{self.name}] Error: RTMP URL not configured")
-            time.sleep(5) # Prevent tight loop
-            return
+                # Interruptible: stop() wakes this immediately
+                if self.stop_event.wait(3.0):
+                    break
 
+    def _build_cmd(self) -> List[str]:
+        """建構 FFmpeg 命令"""
         # Strict low-latency parameters from user request
         p = self.config.ffmpeg_params
         
@@ -81,32 +91,68 @@ class Streamer:
         else:
              pass
 
-        cmd += [
+        cmd += self._encoder_args()
+        cmd += ["-f", "flv", self.config.rtmp_url]
+        
+        # Add extra user flags
+        cmd.extend(p.extra_flags)
+        return cmd
+
+    def _encoder_args(self) -> List[str]:
+        """Video encoder flags: CBR at the configured bitrate with a fixed GOP, whichever encoder is used"""
+        p = self.config.ffmpeg_params
+        bitrate = self.config.bitrate
+        if p.encoder == "h264_nvenc":
+            # NVIDIA GPU encoder: preset / tune above are x264 names, NVENC gets its own low-latency set
+            return [
+                "-c:v", "h264_nvenc",
+                "-profile:v", "main",
+                "-pix_fmt", "yuv420p",
+                "-rc", "cbr",
+                "-b:v", bitrate, "-maxrate", bitrate, "-bufsize", bitrate,
+                "-g", str(p.gop), "-bf", "0",
+                "-preset", "p1", "-tune", "ll", "-zerolatency", "1", "-delay", "0",
+            ]
+        if p.encoder == "h264_v4l2m2m":
+            # V4L2 mem2mem hardware encoder (e.g. Raspberry Pi); takes bitrate / GOP only
+            return [
+                "-c:v", "h264_v4l2m2m",
+                "-pix_fmt", "yuv420p",
+                "-b:v", bitrate,
+                "-g", str(p.gop),
+            ]
+        return [
             "-c:v", "libx264", 
             "-profile:v", "main", 
             "-pix_fmt", "yuv420p",
             # CBR mode for stable streaming (prevents buffer accumulation)
-            "-b:v", self.config.bitrate,
-            "-maxrate", self.config.bitrate,
-            "-bufsize", self.config.bitrate,  # Same as bitrate for tight control
+            "-b:v", bitrate,
+            "-maxrate", bitrate,
+            "-bufsize", bitrate,  # Same as bitrate for tight control
             "-g", str(p.gop), 
             "-x264-params", f"scenecut=0:keyint={p.gop}:min-keyint={p.gop}:nal-hrd=cbr", 
             "-tune", p.tune, 
             "-preset", p.preset,
-            "-f", "flv", self.config.rtmp_url
         ]
-        
-        # Add extra user flags
-        cmd.extend(p.extra_flags)
 
-        print(f"[Streamer:{self.name}] Starting FFmpeg: {' '.join(cmd)}")
+    def _run_ffmpeg(self):
+        if not self._cmd:
+            print(f"[Streamer:{self.name}] Error: RTMP URL not configured")
+            self.stop_event.wait(5.0) # Prevent tight loop (returns early on stop())
+            return
+
+        # 完整命令只在第一次啟動時印出；重啟時 _run_loop 已經有自己的 log
+        self._starts += 1
+        if self._starts == 1:
+            print(f"[Streamer:{self.name}] Starting FFmpeg: {' '.join(self._cmd)}")
+        else:
+            print(f"[Streamer:{self.name}] Starting FFmpeg (restart #{self._starts - 1})")
         
         self.process = subprocess.Popen(
-            cmd, 
+            self._cmd, 
             stdout=subprocess.PIPE, 
-            stderr=subprocess.STDOUT, # Redirect stderr to stdout to avoid deadlock
-            universal_newlines=True,
-            bufsize=1
+            stderr=subprocess.STDOUT # Redirect stderr to stdout to avoid deadlock
+            # Binary, default-buffered pipe: progress lines are parsed as bytes, only stored values get decoded
         )
         
         self.status.running = True
@@ -124,44 +170,45 @@ class Streamer:
         self.status.running = False
         self.status.pid = None
 
-    def _parse_progress(self, line: str):
-        parts = line.split("=", 1)
-        if len(parts) != 2:
+    def _parse_progress(self, line: bytes):
+        k, sep, v = line.partition(b"=")
+        if not sep:
             # Not a progress line - could be an error or warning, log it
             if line:
-                print(f"[Streamer:{self.name}] FFmpeg: {line}")
+                print(f"[Streamer:{self.name}] FFmpeg: {line.decode('utf-8', 'replace')}")
             return
         
-        k, v = parts[0].strip(), parts[1].strip()
+        # float() / int() accept bytes directly; only the string fields are decoded
+        k, v = k.strip(), v.strip()
         
         updated = False
-        if k == "fps":
+        if k == b"fps":
             try:
                 self.status.fps = float(v)
                 updated = True
             except: pass
-        elif k == "bitrate":
-            self.status.bitrate = v
+        elif k == b"bitrate":
+            self.status.bitrate = v.decode("ascii", "replace")
             updated = True
-        elif k == "speed":
-            self.status.speed = v
+        elif k == b"speed":
+            self.status.speed = v.decode("ascii", "replace")
             updated = True
-        elif k == "frame":
+        elif k == b"frame":
             try:
                 self.status.frame = int(v)
                 updated = True
             except: pass
-        elif k == "drop_frames":
+        elif k == b"drop_frames":
             try:
                 self.status.drop_frames = int(v)
                 updated = True
             except: pass
-        elif k == "dup_frames":
+        elif k == b"dup_frames":
             try:
                 self.status.dup_frames = int(v)
                 updated = True
             except: pass
-        elif k == "progress" and v == "continue":
+        elif k == b"progress" and v == b"continue":
             self.status.uptime = time.time() - self.start_time
             self.status.last_update = time.time()
             self._write_status()
@@ -169,11 +216,18 @@ class Streamer:
     def _write_status(self):
         # Write status file if configured
         if self.config.status_file:
+            now = time.monotonic()
+            if now - self._status_written < STATUS_WRITE_INTERVAL:
+                return
+            self._status_written = now
             path = self.config.status_file
             try:
                 tmp = path + ".tmp"
-                with open(tmp, "w") as f:
-                    f.write(self.status.model_dump_json())
+                fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                try:
+                    os.write(fd, self.status.model_dump_json().encode("utf-8"))
+                finally:
+                    os.close(fd)
                 os.replace(tmp, path)
             except:
                 pass
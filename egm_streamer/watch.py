@@ -0,0 +1,111 @@
+import os
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+from pathlib import Path
+from typing import Optional
+
+# <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+# Fallback stat() polling period when inotify is unavailable
+POLL_INTERVAL = 0.05
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len (name follows, NUL padded)
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        libc.inotify_init1  # AttributeError on non-Linux libc
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+class FileWatcher:
+    """
+    等待某個檔案被重新寫入 (snapshot 每更新一次就喚醒一次)
+    Linux: inotify 監看所在目錄的 IN_CLOSE_WRITE (ffmpeg -update 原地覆寫) 與 IN_MOVED_TO (tmp + rename)
+    其他平台或 inotify 無法使用時，退回定期 stat() 比對 (mtime_ns, size, inode)
+    """
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._name = os.fsencode(self.path.name)
+        self._fd: Optional[int] = None
+        # Last seen stat stamp, only used by the polling fallback
+        self._stamp = self._stat_stamp()
+
+        libc = _load_libc()
+        if libc is None:
+            print("[Watch] inotify unavailable, falling back to stat polling")
+            return
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            print(f"[Watch] inotify_init1 failed: {os.strerror(ctypes.get_errno())}, falling back to stat polling")
+            return
+        wd = libc.inotify_add_watch(fd, os.fsencode(str(self.path.parent)), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            print(f"[Watch] Cannot watch {self.path.parent}: {os.strerror(ctypes.get_errno())}, falling back to stat polling")
+            os.close(fd)
+            return
+        self._fd = fd
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Block until the file is rewritten or `timeout` seconds pass.
+        Events that arrived since the previous call count immediately.
+        Return: True if the file changed
+        """
+        deadline = time.monotonic() + timeout
+        if self._fd is None:
+            return self._poll(deadline)
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            ready, _, _ = select.select([self._fd], [], [], remaining)
+            if not ready:
+                return False
+            if self._drain():
+                return True
+
+    def _stat_stamp(self) -> Optional[tuple]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _poll(self, deadline: float) -> bool:
+        """Fallback: stat() every POLL_INTERVAL until the stamp changes or the deadline passes"""
+        while True:
+            stamp = self._stat_stamp()
+            if stamp != self._stamp:
+                self._stamp = stamp
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(POLL_INTERVAL, remaining))
+
+    def _drain(self) -> bool:
+        """Read all pending events; True if any of them is for the watched file"""
+        hit = False
+        while True:
+            try:
+                buf = os.read(self._fd, 4096)
+            except BlockingIOError:
+                return hit
+            offset = 0
+            while offset + _EVENT_HEADER.size <= len(buf):
+                _, _, _, name_len = _EVENT_HEADER.unpack_from(buf, offset)
+                start = offset + _EVENT_HEADER.size
+                if buf[start:start + name_len].rstrip(b"\0") == self._name:
+                    hit = True
+                offset = start + name_len
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -1,17 +1,36 @@
 #!/opt/freegame-venv/bin/python
 import argparse
-import glob
 import io
 import json
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 from datetime import datetime, timezone
-from typing import List, Optional, Tuple
+from typing import IO, Callable, List, Optional, Tuple
 
 from PIL import Image
 import imagehash
 
+# 灰階解碼方式；freegame_classify 解 frame 必須用同一種，cache 裡記錄這個值，不同就會重建
+DECODE_MODE = "luma"
+
+# --decode-scale：libjpeg 直接以 1/2、1/4、1/8 解碼 (DCT scaling)，ROI 座標跟著縮
+DECODE_SCALES = (1, 2, 4, 8)
+
+
+def decode_mode(scale: int) -> str:
+    # cache 的 "decode" 值；scale=1 沿用原本的 "luma"，舊 cache 不必重建
+    return DECODE_MODE if scale == 1 else f"{DECODE_MODE}/{scale}"
+
+# hash 縮圖濾鏡：lanczos = imagehash 內建 (預設)；box = 區塊平均，大 ROI 快數倍，但 hash 與 lanczos 不同
+# cache 裡記錄這個值，兩邊不同就會重建
+RESIZE_FILTERS = {
+    "lanczos": None,
+    "box": Image.BOX,
+}
+
 
 def ts_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
@@ -29,32 +48,56 @@ def parse_roi(s: Optional[str]) -> Optional[Tuple[int, int, int, int]]:
     return (x, y, w, h)
 
 
-def crop(img: Image.Image, roi: Optional[Tuple[int, int, int, int]]) -> Image.Image:
+def crop(img: Image.Image, roi: Optional[Tuple[int, int, int, int]], scale: int = 1) -> Image.Image:
+    # roi 是原尺寸座標；scale > 1 時 img 已經縮小解碼，座標跟著除
     if not roi:
         return img
     x, y, w, h = roi
-    return img.crop((x, y, x + w, y + h))
+    x0, y0 = x // scale, y // scale
+    return img.crop((x0, y0, max(x0 + 1, (x + w) // scale), max(y0 + 1, (y + h) // scale)))
 
 
-def atomic_write(path: str, content: str) -> None:
+def atomic_write(path: str, write: Callable[[IO[str]], None]) -> None:
+    """write(f) 直接寫進 tmp 檔 (可以串流寫入，不必先組出整份字串)，fsync 後再 rename"""
     p = Path(path)
     p.parent.mkdir(parents=True, exist_ok=True)
     tmp = str(p) + ".tmp"
     with open(tmp, "w", encoding="utf-8") as f:
-        f.write(content)
+        write(f)
         f.flush()
         os.fsync(f.fileno())
     os.replace(tmp, path)
 
 
-def load_img_gray(path: str) -> Image.Image:
+def load_img_gray(path: str, scale: int = 1) -> Image.Image:
     with open(path, "rb") as f:
         data = f.read()
     img = Image.open(io.BytesIO(data))
-    return img.convert("L")
+    # JPEG: draft("L") 讓 libjpeg 只解 Y (luma) 平面，省掉 chroma upsampling 與 RGB -> L 轉換
+    # scale > 1 時同時用 libjpeg 的 DCT scaling 縮小解碼
+    w, h = img.size
+    img.draft("L", (w // scale, h // scale))
+    img = img if img.mode == "L" else img.convert("L")
+    if scale > 1 and img.size == (w, h):
+        # 非 JPEG (draft 無作用)：解完再縮成同樣大小
+        img = img.reduce(scale)
+    return img
+
+
+def hash_input_size(algo: str, hash_size: int) -> Tuple[int, int]:
+    # imagehash 內部縮圖的目標尺寸 (w, h)
+    if algo == "dhash":
+        return (hash_size + 1, hash_size)
+    if algo == "phash":
+        return (hash_size * 4, hash_size * 4)  # highfreq_factor=4
+    return (hash_size, hash_size)
 
 
-def get_hash(img: Image.Image, algo: str, hash_size: int):
+def get_hash(img: Image.Image, algo: str, hash_size: int, resize: str = "lanczos"):
+    resample = RESIZE_FILTERS[resize]
+    if resample is not None:
+        # 先用指定濾鏡縮到 hash 要的尺寸；imagehash 再 resize 到同尺寸時只是 copy，不會再縮一次
+        img = img.resize(hash_input_size(algo, hash_size), resample)
     if algo == "phash":
         return imagehash.phash(img, hash_size=hash_size)
     if algo == "dhash":
@@ -64,81 +107,112 @@ def get_hash(img: Image.Image, algo: str, hash_size: int):
     raise ValueError("algo must be one of: phash, dhash, ahash")
 
 
-def collect_files(ref_path: str) -> List[str]:
+def scan_refs(ref_path: str) -> Tuple[List[Tuple[str, int]], int]:
+    """
+    一次 scandir 取得 refs 檔案清單與各檔 mtime (後面 hash 時不必再 stat)，以及最新 mtime
+    (與 freegame_classify 的 latest_mtime_in_dir 同樣算法：資料夾本身的 mtime 也算在內，刪除 ref 才會觸發重建)
+    ref_path 可以是單一檔案或資料夾；不存在時回傳 ([], 0)
+    Return: ([(path, mtime_epoch), ...] 依路徑排序, latest_mtime_epoch)
+    """
     if os.path.isfile(ref_path):
-        return [ref_path]
-    if os.path.isdir(ref_path):
-        cand = sorted(glob.glob(os.path.join(ref_path, "*")))
-        return [
-            p for p in cand
-            if os.path.isfile(p) and p.lower().endswith((".jpg", ".jpeg", ".png", ".webp"))
-        ]
-    return []
-
-
-def latest_mtime_in_dir(ref_path: str) -> int:
-    p = Path(ref_path)
-    if p.is_file():
         try:
-            return int(p.stat().st_mtime)
+            mt = int(os.stat(ref_path).st_mtime)
         except:
-            return 0
-    if not p.is_dir():
-        return 0
-    mt = 0
-    for f in p.glob("*"):
-        if f.is_file() and f.suffix.lower() in (".jpg", ".jpeg", ".png", ".webp"):
+            mt = 0
+        return [(ref_path, mt)], mt
+    if not os.path.isdir(ref_path):
+        return [], 0
+    try:
+        dir_mt = int(os.stat(ref_path).st_mtime)
+    except OSError:
+        return [], 0
+    refs = []
+    with os.scandir(ref_path) as it:
+        for e in it:
+            if not e.name.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
+                continue
             try:
-                mt = max(mt, int(f.stat().st_mtime))
-            except:
-                pass
-    return mt
-
-
-def build_items(files: List[str], roi, algo: str, hash_size: int) -> List[dict]:
+                if not e.is_file():
+                    continue
+                refs.append((e.path, int(e.stat().st_mtime)))
+            except OSError:
+                continue
+    refs.sort()
+    return refs, max([dir_mt] + [mt for _, mt in refs])
+
+
+def build_items(refs: List[Tuple[str, int]], roi, algo: str, hash_size: int, resize: str = "lanczos",
+                decode_scale: int = 1) -> List[dict]:
+    return build_items_multi(refs, [roi], algo, hash_size, resize, decode_scale)[0]
+
+
+def _hash_file(ref: Tuple[str, int], rois: list, algo: str, hash_size: int, resize: str = "lanczos",
+               decode_scale: int = 1) -> List[dict]:
+    """
+    讀檔 + 解碼一次，對每個 ROI 計算 hash；每個 ROI 回傳一個 item (失敗的 hash 為空字串)
+    ref: (path, mtime_epoch)，mtime 來自 scan_refs
+    """
+    fp, mtime = ref
+    try:
+        img = load_img_gray(fp, decode_scale)
+    except Exception as e:
+        # 不中斷整批，跳過壞檔
+        return [{"file": fp, "mtime_epoch": 0, "hash": "", "error": str(e)} for _ in rois]
     items = []
-    for fp in files:
+    for roi in rois:
         try:
-            img = crop(load_img_gray(fp), roi)
-            h = get_hash(img, algo, hash_size)
-            mtime = 0
-            try:
-                mtime = int(Path(fp).stat().st_mtime)
-            except:
-                mtime = 0
+            h = get_hash(crop(img, roi, decode_scale), algo, hash_size, resize)
             items.append({
                 "file": fp,
                 "mtime_epoch": mtime,
                 "hash": str(h),  # hex string
             })
         except Exception as e:
-            # 不中斷整批，跳過壞檔
             items.append({
                 "file": fp,
                 "mtime_epoch": 0,
                 "hash": "",
                 "error": str(e),
             })
-    # 濾掉失敗的
-    items = [it for it in items if it.get("hash")]
     return items
 
 
+def build_items_multi(refs: List[Tuple[str, int]], rois: list, algo: str, hash_size: int, resize: str = "lanczos",
+                      decode_scale: int = 1) -> List[List[dict]]:
+    """
+    同一批檔案對多個 ROI 計算 hash，每個檔案只讀檔 + 解碼一次 (play1 / play2 共用 play refs)
+    檔案之間互相獨立：多個檔案時分給多個 process (結果順序與 refs 相同)
+    Return: 每個 ROI 一份 items (格式同 build_items)
+    """
+    work = partial(_hash_file, rois=rois, algo=algo, hash_size=hash_size, resize=resize, decode_scale=decode_scale)
+    if len(refs) < 4 or (os.cpu_count() or 1) < 2:
+        per_file = [work(ref) for ref in refs]
+    else:
+        with ProcessPoolExecutor() as ex:
+            per_file = list(ex.map(work, refs, chunksize=4))
+    # 濾掉失敗的
+    return [[items[i] for items in per_file if items[i].get("hash")] for i in range(len(rois))]
+
+
 def write_cache(path: str,
                 roi_name: str,
                 roi,
                 algo: str,
                 hash_size: int,
+                resize: str,
                 ref_select_path: str,
                 ref_play_path: str,
                 sel_latest: int,
                 play_latest: int,
-                items: List[dict]) -> None:
+                items: List[dict],
+                decode_scale: int = 1) -> None:
     x, y, w, h = roi
     doc = {
         "ts": ts_iso(),
         "algo": algo,
         "hash_size": int(hash_size),
+        "decode": decode_mode(decode_scale),
+        "resize": resize,
         "roi": {"name": roi_name, "x": int(x), "y": int(y), "w": int(w), "h": int(h)},
         # 讓 classify 那邊可以用來判斷 refs 是否更新
         "refs_latest_mtime_epoch": {
@@ -152,10 +226,14 @@ def write_cache(path: str,
         "items": items,
         "count": len(items),
     }
-    atomic_write(path, json.dumps(doc, ensure_ascii=False, indent=2) + "\n")
+    def write(f):
+        # 直接串流進檔案：大量 refs 時不會先在記憶體組出整份 JSON 字串
+        json.dump(doc, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    atomic_write(path, write)
 
 
-def main():
+def main(argv: Optional[List[str]] = None):
     ap = argparse.ArgumentParser()
 
     ap.add_argument("--ref-select", required=True, help="SELECT refs folder or file")
@@ -167,18 +245,20 @@ def main():
 
     ap.add_argument("--algo", default="dhash", choices=["phash", "dhash", "ahash"])
     ap.add_argument("--hash-size", type=int, default=8)
+    ap.add_argument("--resize", default="lanczos", choices=list(RESIZE_FILTERS), help="hash downscale filter (box: faster, different hashes)")
+    ap.add_argument("--decode-scale", type=int, default=1, choices=DECODE_SCALES, help="decode JPEGs at 1/N size (ROIs stay in full-size coords)")
 
     ap.add_argument("--out-dir", required=True)
     ap.add_argument("--out-prefix", default="refhash")
 
-    args = ap.parse_args()
+    args = ap.parse_args(argv)
 
     roi_select = parse_roi(args.roi_select)
     roi_play1 = parse_roi(args.roi_play1)
     roi_play2 = parse_roi(args.roi_play2) if args.roi_play2 else None
 
-    sel_files = collect_files(args.ref_select)
-    play_files = collect_files(args.ref_play)
+    sel_files, sel_latest = scan_refs(args.ref_select)
+    play_files, play_latest = scan_refs(args.ref_play)
 
     if not sel_files:
         print(f"[ERROR] no valid select refs: {args.ref_select}", file=sys.stderr)
@@ -187,9 +267,6 @@ def main():
         print(f"[ERROR] no valid play refs: {args.ref_play}", file=sys.stderr)
         sys.exit(2)
 
-    sel_latest = latest_mtime_in_dir(args.ref_select)
-    play_latest = latest_mtime_in_dir(args.ref_play)
-
     out_dir = Path(args.out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
 
@@ -197,9 +274,12 @@ def main():
     p_p1  = str(out_dir / f"{args.out_prefix}_play1.json")
     p_p2  = str(out_dir / f"{args.out_prefix}_play2.json")
 
-    sel_items = build_items(sel_files, roi_select, args.algo, args.hash_size)
-    p1_items  = build_items(play_files, roi_play1, args.algo, args.hash_size)
-    p2_items  = build_items(play_files, roi_play2, args.algo, args.hash_size) if roi_play2 else []
+    sel_items = build_items(sel_files, roi_select, args.algo, args.hash_size, args.resize, args.decode_scale)
+    # play1 / play2 hash the same play refs: decode each file once for both ROIs
+    play_rois = [roi_play1, roi_play2] if roi_play2 else [roi_play1]
+    play_items = build_items_multi(play_files, play_rois, args.algo, args.hash_size, args.resize, args.decode_scale)
+    p1_items  = play_items[0]
+    p2_items  = play_items[1] if roi_play2 else []
 
     if not sel_items:
         print("[ERROR] select refs all failed to hash", file=sys.stderr)
@@ -208,18 +288,18 @@ def main():
         print("[ERROR] play1 refs all failed to hash", file=sys.stderr)
         sys.exit(2)
 
-    write_cache(p_sel, "select", roi_select, args.algo, args.hash_size,
-                args.ref_select, args.ref_play, sel_latest, play_latest, sel_items)
+    write_cache(p_sel, "select", roi_select, args.algo, args.hash_size, args.resize,
+                args.ref_select, args.ref_play, sel_latest, play_latest, sel_items, args.decode_scale)
 
-    write_cache(p_p1, "play1", roi_play1, args.algo, args.hash_size,
-                args.ref_select, args.ref_play, sel_latest, play_latest, p1_items)
+    write_cache(p_p1, "play1", roi_play1, args.algo, args.hash_size, args.resize,
+                args.ref_select, args.ref_play, sel_latest, play_latest, p1_items, args.decode_scale)
 
     if roi_play2:
         if not p2_items:
             print("[WARN] play2 roi set but no hashes produced; skip play2 cache", file=sys.stderr)
         else:
-            write_cache(p_p2, "play2", roi_play2, args.algo, args.hash_size,
-                        args.ref_select, args.ref_play, sel_latest, play_latest, p2_items)
+            write_cache(p_p2, "play2", roi_play2, args.algo, args.hash_size, args.resize,
+                        args.ref_select, args.ref_play, sel_latest, play_latest, p2_items, args.decode_scale)
 
     print(f"OK: {p_sel}")
     print(f"OK: {p_p1}")
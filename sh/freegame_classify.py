@@ -1,24 +1,49 @@
 #!/opt/freegame-venv/bin/python
-import argparse, io, json, os, sys, time, glob, subprocess
+import argparse, contextlib, importlib.machinery, importlib.util, io, json, os, sys, time, glob, subprocess
 from pathlib import Path
 from typing import List, Optional, Tuple
 from datetime import datetime, timezone
 
+import numpy as np
 from PIL import Image
 import imagehash
 
+# 灰階解碼方式，必須與 build_refhash 相同 (cache 的 "decode" 欄位不同就重建)
+DECODE_MODE = "luma"
+
+# --decode-scale：libjpeg 直接以 1/2、1/4、1/8 解碼 (DCT scaling)，ROI 座標跟著縮
+DECODE_SCALES = (1, 2, 4, 8)
+
+# hash 縮圖濾鏡，必須與 build_refhash 相同 (cache 的 "resize" 欄位不同就重建)
+# lanczos = imagehash 內建 (預設)；box = 區塊平均，大 ROI 快數倍，但 hash 與 lanczos 不同
+RESIZE_FILTERS = {
+    "lanczos": None,
+    "box": Image.BOX,
+}
+
 # -------------------------
 # helpers
 # -------------------------
-def load_img_gray_retry(path: str, tries: int = 5, sleep_s: float = 0.02) -> Image.Image:
+def decode_mode(scale: int) -> str:
+    # 與 build_refhash 相同：scale=1 為 "luma"，否則 "luma/<scale>"
+    return DECODE_MODE if scale == 1 else f"{DECODE_MODE}/{scale}"
+
+def load_img_gray_retry(path: str, tries: int = 5, sleep_s: float = 0.02, scale: int = 1) -> Image.Image:
     last = None
     for _ in range(tries):
         try:
             with open(path, "rb") as f:
                 data = f.read()
             img = Image.open(io.BytesIO(data))
+            # JPEG: 只解 Y (luma) 平面，省掉 chroma upsampling 與 RGB -> L 轉換；scale > 1 時直接縮小解碼
+            w, h = img.size
+            img.draft("L", (w // scale, h // scale))
             img.load()  # 強制完整解碼，避免半張圖
-            return img.convert("L")
+            img = img if img.mode == "L" else img.convert("L")
+            if scale > 1 and img.size == (w, h):
+                # 非 JPEG (draft 無作用)：解完再縮，與 build_refhash 相同
+                img = img.reduce(scale)
+            return img
         except Exception as e:
             last = e
             time.sleep(sleep_s)
@@ -35,11 +60,13 @@ def parse_roi(s: Optional[str]) -> Optional[Tuple[int, int, int, int]]:
         raise ValueError("ROI w/h must be > 0")
     return (x, y, w, h)
 
-def crop(img: Image.Image, roi: Optional[Tuple[int, int, int, int]]) -> Image.Image:
+def crop(img: Image.Image, roi: Optional[Tuple[int, int, int, int]], scale: int = 1) -> Image.Image:
+    # roi 是原尺寸座標；scale > 1 時 img 已經縮小解碼，座標跟著除
     if not roi:
         return img
     x, y, w, h = roi
-    return img.crop((x, y, x + w, y + h))
+    x0, y0 = x // scale, y // scale
+    return img.crop((x0, y0, max(x0 + 1, (x + w) // scale), max(y0 + 1, (y + h) // scale)))
 
 def atomic_write(path: str, content: str) -> None:
     p = Path(path)
@@ -56,9 +83,22 @@ def load_img_gray(path: str) -> Image.Image:
     with open(path, "rb") as f:
         data = f.read()
     img = Image.open(io.BytesIO(data))
-    return img.convert("L")
+    img.draft("L", img.size)
+    return img if img.mode == "L" else img.convert("L")
 
-def get_hash(img: Image.Image, algo: str, hash_size: int):
+def hash_input_size(algo: str, hash_size: int) -> Tuple[int, int]:
+    # imagehash 內部縮圖的目標尺寸 (w, h)
+    if algo == "dhash":
+        return (hash_size + 1, hash_size)
+    if algo == "phash":
+        return (hash_size * 4, hash_size * 4)  # highfreq_factor=4
+    return (hash_size, hash_size)
+
+def get_hash(img: Image.Image, algo: str, hash_size: int, resize: str = "lanczos"):
+    resample = RESIZE_FILTERS[resize]
+    if resample is not None:
+        # 先用指定濾鏡縮到 hash 要的尺寸；imagehash 再 resize 到同尺寸時只是 copy，不會再縮一次
+        img = img.resize(hash_input_size(algo, hash_size), resample)
     if algo == "phash":
         return imagehash.phash(img, hash_size=hash_size)
     if algo == "dhash":
@@ -76,26 +116,52 @@ def best_k_mean(dists: List[int], k: int) -> float:
     return sum(best) / len(best)
 
 def latest_mtime_in_dir(ref_path: str) -> int:
-    p = Path(ref_path)
-    mt = 0
-    if p.is_file():
+    # 與 build_refhash 的 scan_refs 同樣算法：資料夾本身 + 各 ref 檔的最新 mtime
+    # 資料夾 mtime 在新增 / 刪除 / rename 時會變 (刪掉 ref 也會觸發重建)，檔案 mtime 負責抓原地覆寫
+    if os.path.isfile(ref_path):
         try:
-            return int(p.stat().st_mtime)
+            return int(os.stat(ref_path).st_mtime)
         except:
             return 0
-    if not p.is_dir():
+    if not os.path.isdir(ref_path):
         return 0
-    for f in p.glob("*"):
-        if f.is_file() and f.suffix.lower() in (".jpg", ".jpeg", ".png", ".webp"):
+    try:
+        mt = int(os.stat(ref_path).st_mtime)
+    except:
+        return 0
+    # scandir 的 is_file() 用 d_type，不必另外 stat；每個 ref 檔只 stat 一次
+    with os.scandir(ref_path) as it:
+        for e in it:
+            if not e.name.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
+                continue
             try:
-                mt = max(mt, int(f.stat().st_mtime))
-            except:
+                if e.is_file():
+                    mt = max(mt, int(e.stat().st_mtime))
+            except OSError:
                 pass
     return mt
 
-def min_dist(cur_hash, ref_hashes) -> int:
-    # ref_hashes: List[ImageHash]
-    return min(int(cur_hash - rh) for rh in ref_hashes)
+# NumPy < 2.0 沒有 np.bitwise_count：改用 16-bit popcount 查表
+_POPCNT16 = None if hasattr(np, "bitwise_count") else np.array([bin(i).count("1") for i in range(1 << 16)], dtype=np.uint8)
+
+def popcount_u64(arr: np.ndarray) -> np.ndarray:
+    if _POPCNT16 is None:
+        return np.bitwise_count(arr)
+    mask = np.uint64(0xFFFF)
+    return (_POPCNT16[arr & mask]
+            + _POPCNT16[(arr >> np.uint64(16)) & mask]
+            + _POPCNT16[(arr >> np.uint64(32)) & mask]
+            + _POPCNT16[arr >> np.uint64(48)])
+
+def hex_to_words(hexes: List[str], words: int) -> np.ndarray:
+    # hex string (= str(ImageHash)) 左補 0 到 words 個 uint64，big-endian 拆開 -> (N, words)
+    buf = b"".join(bytes.fromhex(h.zfill(words * 16)) for h in hexes)
+    return np.frombuffer(buf, dtype=">u8").astype(np.uint64).reshape(len(hexes), words)
+
+def min_dist(cur_hash, ref_hashes: np.ndarray) -> int:
+    # ref_hashes: (N, words) uint64 (to_hash_list)；一次 XOR + popcount 算完所有 refs
+    cur = hex_to_words([str(cur_hash)], ref_hashes.shape[1])
+    return int(popcount_u64(ref_hashes ^ cur).sum(axis=1).min())
 
 def read_prev(out_path: str) -> tuple[str, int, int, int]:
     prev_state = "NONE"
@@ -183,12 +249,18 @@ def load_refhash_json(path: str):
         return json.load(f)
 
 def validate_cache(cache: dict, expected_roi, algo: str, hash_size: int,
-                   expected_ref_path: str, expected_latest_mtime: int) -> Optional[str]:
+                   expected_ref_path: str, expected_latest_mtime: int, resize: str = "lanczos",
+                   decode_scale: int = 1) -> Optional[str]:
     # ROI/Algo/HashSize 要一致
     if cache.get("algo") != algo:
         return f"algo mismatch cache={cache.get('algo')} expected={algo}"
     if int(cache.get("hash_size", -1)) != int(hash_size):
         return f"hash_size mismatch cache={cache.get('hash_size')} expected={hash_size}"
+    if cache.get("decode") != decode_mode(decode_scale):
+        return f"decode mismatch cache={cache.get('decode')} expected={decode_mode(decode_scale)}"
+    # 舊 cache 沒有 resize 欄位 = lanczos
+    if cache.get("resize", "lanczos") != resize:
+        return f"resize mismatch cache={cache.get('resize', 'lanczos')} expected={resize}"
 
     roi = cache.get("roi") or {}
     if (int(roi.get("x", -1)), int(roi.get("y", -1)), int(roi.get("w", -1)), int(roi.get("h", -1))) != expected_roi:
@@ -211,32 +283,62 @@ def validate_cache(cache: dict, expected_roi, algo: str, hash_size: int,
 
     return None
 
-def to_hash_list(items: list) -> List:
-    hs = []
-    for it in items:
-        h = it.get("hash")
-        if not h:
-            continue
-        hs.append(imagehash.hex_to_hash(h))
-    return hs
+def to_hash_list(items: list) -> np.ndarray:
+    # cache items -> (N, words) uint64，載入時轉一次，min_dist 直接用
+    hs = [it["hash"] for it in items if it.get("hash")]
+    words = max(1, -(-max((len(h) for h in hs), default=0) // 16))
+    return hex_to_words(hs, words)
+
+def run_build_refhash_inprocess(build_refhash_path: str, argv: List[str]) -> bool:
+    """
+    在同一個 process 裡 import build_refhash 並呼叫 main(argv)，省掉再啟動一次 Python + PIL/imagehash/numpy import
+    Return: False 表示無法在 process 內執行 (只有載入失敗)，呼叫端改走 subprocess
+    main() 本身的錯誤 (hash / I/O) 直接以 RuntimeError 拋出，不會再用 subprocess 重跑一次
+    """
+    try:
+        loader = importlib.machinery.SourceFileLoader("build_refhash", build_refhash_path)
+        spec = importlib.util.spec_from_file_location("build_refhash", build_refhash_path, loader=loader)
+        m = importlib.util.module_from_spec(spec)
+        # build_refhash 的 ProcessPoolExecutor 要能用模組名 pickle _hash_file
+        sys.modules[spec.name] = m
+        spec.loader.exec_module(m)
+    except Exception:
+        sys.modules.pop("build_refhash", None)
+        return False
+
+    # build_refhash 的 OK/ERROR 輸出不能混進 classify 的 stdout (FREEGAME=...)
+    out = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+            m.main(argv)
+    except SystemExit as e:
+        if e.code:
+            raise RuntimeError(f"build_refhash failed rc={e.code} output:\n{out.getvalue()}")
+    except Exception as e:
+        raise RuntimeError(f"build_refhash failed: {e!r} output:\n{out.getvalue()}") from e
+    return True
 
 def rebuild_cache(build_refhash_path: str, args, roi_select, roi_play1, roi_play2) -> None:
-    cmd = [
-        build_refhash_path,
+    argv = [
         "--ref-select", args.ref_select,
         "--ref-play", args.ref_play,
         "--roi-select", f"{roi_select[0]},{roi_select[1]},{roi_select[2]},{roi_select[3]}",
         "--roi-play1",  f"{roi_play1[0]},{roi_play1[1]},{roi_play1[2]},{roi_play1[3]}",
         "--algo", args.algo,
         "--hash-size", str(args.hash_size),
+        "--resize", args.resize,
+        "--decode-scale", str(args.decode_scale),
         "--out-dir", args.refhash_dir,
         "--out-prefix", args.refhash_prefix,
     ]
     if roi_play2:
-        cmd += ["--roi-play2", f"{roi_play2[0]},{roi_play2[1]},{roi_play2[2]},{roi_play2[3]}"]
+        argv += ["--roi-play2", f"{roi_play2[0]},{roi_play2[1]},{roi_play2[2]},{roi_play2[3]}"]
+
+    if run_build_refhash_inprocess(build_refhash_path, argv):
+        return
 
-    # 用 subprocess 跑一次 build_refhash
-    r = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    # 無法在 process 內執行：用 subprocess 跑一次 build_refhash
+    r = subprocess.run([build_refhash_path] + argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
     if r.returncode != 0:
         raise RuntimeError(f"build_refhash failed rc={r.returncode} output:\n{r.stdout}")
 
@@ -255,21 +357,21 @@ def load_or_build_refhashes(args, roi_select, roi_play1, roi_play2):
         p1_cache  = load_refhash_json(p_p1)
         p2_cache  = load_refhash_json(p_p2) if (roi_play2 and os.path.isfile(p_p2)) else None
 
-        err = validate_cache(sel_cache, roi_select, args.algo, args.hash_size, args.ref_select, sel_latest)
+        err = validate_cache(sel_cache, roi_select, args.algo, args.hash_size, args.ref_select, sel_latest, args.resize, args.decode_scale)
         if err: return None, f"select cache invalid: {err}"
-        err = validate_cache(p1_cache, roi_play1, args.algo, args.hash_size, args.ref_play, play_latest)
+        err = validate_cache(p1_cache, roi_play1, args.algo, args.hash_size, args.ref_play, play_latest, args.resize, args.decode_scale)
         if err: return None, f"play1 cache invalid: {err}"
         if roi_play2 and p2_cache:
-            err = validate_cache(p2_cache, roi_play2, args.algo, args.hash_size, args.ref_play, play_latest)
+            err = validate_cache(p2_cache, roi_play2, args.algo, args.hash_size, args.ref_play, play_latest, args.resize, args.decode_scale)
             if err: return None, f"play2 cache invalid: {err}"
 
         sel_refs = to_hash_list(sel_cache.get("items") or [])
         p1_refs  = to_hash_list(p1_cache.get("items") or [])
-        p2_refs  = to_hash_list(p2_cache.get("items") or []) if p2_cache else []
+        p2_refs  = to_hash_list(p2_cache.get("items") or []) if p2_cache else to_hash_list([])
 
-        if not sel_refs:
+        if not len(sel_refs):
             return None, "select cache has 0 hashes"
-        if not p1_refs:
+        if not len(p1_refs):
             return None, "play1 cache has 0 hashes"
 
         return (sel_refs, p1_refs, p2_refs), None
@@ -300,60 +402,60 @@ def load_or_build_refhashes(args, roi_select, roi_play1, roi_play2):
     return loaded, "cache_rebuilt"
 
 # -------------------------
-# main
+# classify
 # -------------------------
-def main():
-    ap = argparse.ArgumentParser()
-
-    ap.add_argument("--snap", default="/dev/shm/freegame/snap.jpg")
-    ap.add_argument("--out", default="/dev/shm/freegame/freegame.status")
-
-    # refs path（用來判斷 refs 是否更新）
-    ap.add_argument("--ref-select", required=True, help="SELECT refs folder or file")
-    ap.add_argument("--ref-play", required=True, help="PLAY refs folder or file")
-
-    # ROI（必須與 build_refhash 一致）
-    ap.add_argument("--roi-select", required=True, help="x,y,w,h")
-    ap.add_argument("--roi-play1", required=True, help="x,y,w,h")
-    ap.add_argument("--roi-play2", default=None, help="x,y,w,h (optional)")
-
-    # thresholds
-    ap.add_argument("--select-enter", type=int, default=12)
-    ap.add_argument("--select-exit", type=int, default=16)
-    ap.add_argument("--play-enter", type=int, default=12)
-    ap.add_argument("--play-exit", type=int, default=16)
-
-    # sampling
-    ap.add_argument("--samples", type=int, default=3)
-    ap.add_argument("--interval", type=float, default=0.15)
-    ap.add_argument("--bestk", type=int, default=0, help="0 => auto (=need)")
-
-    # hash settings（必須與 build_refhash 一致）
-    ap.add_argument("--algo", default="dhash", choices=["phash", "dhash", "ahash"])
-    ap.add_argument("--hash-size", type=int, default=8)
-
-    # debounce
-    ap.add_argument("--confirm-select", type=int, default=2)
-    ap.add_argument("--confirm-play", type=int, default=2)
-    ap.add_argument("--drop-select-none", type=int, default=6)
-    ap.add_argument("--drop-play-none", type=int, default=6)
-
-    # cache settings
-    ap.add_argument("--refhash-dir", default="/dev/shm/freegame")
-    ap.add_argument("--refhash-prefix", default="refhash")
-    ap.add_argument("--auto-rebuild-cache", type=int, default=1, help="1: missing/invalid cache -> rebuild via build_refhash")
-    ap.add_argument("--build-refhash", default="", help="path to build_refhash.py (optional)")
-
-    args = ap.parse_args()
-
-    roi_select = parse_roi(args.roi_select)
-    roi_play1  = parse_roi(args.roi_play1)
-    roi_play2  = parse_roi(args.roi_play2) if args.roi_play2 else None
+def write_refhash_failed(out_path: str, e: Exception) -> None:
+    atomic_write(out_path, f"ts={ts_iso()} epoch={int(time.time())} state=UNKNOWN reason=refhash_failed err={str(e).replace(' ','_')}\n")
+
+def run_daemon(args, roi_select, roi_play1, roi_play2) -> None:
+    """
+    常駐模式：import / argparse / refs 載入只做一次，之後每 --daemon-interval 秒跑一次 classify
+    refs 資料夾的最新 mtime 變了才重新 load_or_build_refhashes (與單次模式一樣會驗證 / 重建 cache)
+    """
+    refs, refs_key = None, None
+    cache_status = "cache_ok"
+    last_state = None
+    t0 = time.monotonic()
+    n = 0
+    while True:
+        if not os.path.isfile(args.snap):
+            atomic_write(args.out, f"ts={ts_iso()} epoch={int(time.time())} state=UNKNOWN reason=snap_missing\n")
+            state = "UNKNOWN"
+        else:
+            key = (latest_mtime_in_dir(args.ref_select), latest_mtime_in_dir(args.ref_play))
+            if refs is None or key != refs_key:
+                try:
+                    refs, cache_status = load_or_build_refhashes(args, roi_select, roi_play1, roi_play2)
+                    refs_key = key
+                    print(f"refs loaded ({cache_status}) select={len(refs[0])} play1={len(refs[1])} play2={len(refs[2])}")
+                except Exception as e:
+                    refs = None
+                    write_refhash_failed(args.out, e)
+                    print(f"UNKNOWN refhash_failed: {e}")
+            state = "UNKNOWN"
+            if refs is not None:
+                state = classify(args, roi_select, roi_play1, roi_play2, refs, cache_status)
+                cache_status = "cache_ok"
+
+        # 只在狀態改變時印出，避免每輪洗 log
+        if state != last_state:
+            print(f"FREEGAME={state}", flush=True)
+            last_state = state
+
+        # 固定排程 (t0 + n*interval)：分類本身花的時間不會拉長週期
+        n += 1
+        remaining = t0 + n * args.daemon_interval - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+        else:
+            t0, n = time.monotonic(), 0
 
-    if not os.path.isfile(args.snap):
-        atomic_write(args.out, f"ts={ts_iso()} epoch={int(time.time())} state=UNKNOWN reason=snap_missing\n")
-        print("UNKNOWN snap_missing")
-        sys.exit(2)
+def classify(args, roi_select, roi_play1, roi_play2, refs, cache_status: str) -> str:
+    """
+    取樣 + 判斷一次，結果寫到 args.out
+    Return: PLAY / SELECT / NONE，解碼失敗時為 UNKNOWN
+    """
+    sel_refs, play1_refs, play2_refs = refs
 
     # read prev state
     prev_state, prev_ss, prev_ps, prev_ns = read_prev(args.out)
@@ -366,39 +468,39 @@ def main():
     k = args.bestk if args.bestk > 0 else need
     k = max(1, min(k, args.samples))
 
-    # load ref hashes from /dev/shm (or rebuild)
-    try:
-        (sel_refs, play1_refs, play2_refs), cache_status = load_or_build_refhashes(
-            args, roi_select, roi_play1, roi_play2
-        )
-    except Exception as e:
-        atomic_write(args.out, f"ts={ts_iso()} epoch={int(time.time())} state=UNKNOWN reason=refhash_failed err={str(e).replace(' ','_')}\n")
-        print(f"UNKNOWN refhash_failed: {e}")
-        sys.exit(2)
-
     # sample loop
     dsel: List[int] = []
     dplay1: List[int] = []
     dplay2: List[int] = []
 
+    # snap.jpg 通常比 sample interval 更新得慢：檔案沒變 (mtime/size/inode 相同) 就沿用上一個 sample 的距離，不必再解碼 + hash
+    last_key = None
+    last_d: Tuple[int, int, Optional[int]] = (0, 0, None)
+
     for i in range(args.samples):
         try:
-            full = load_img_gray_retry(args.snap)
+            st = os.stat(args.snap)
+            key = (st.st_mtime_ns, st.st_size, st.st_ino)
+            if key != last_key:
+                full = load_img_gray_retry(args.snap, scale=args.decode_scale)
 
-            hs  = get_hash(crop(full, roi_select), args.algo, args.hash_size)
-            hp1 = get_hash(crop(full, roi_play1),  args.algo, args.hash_size)
+                hs  = get_hash(crop(full, roi_select, args.decode_scale), args.algo, args.hash_size, args.resize)
+                hp1 = get_hash(crop(full, roi_play1, args.decode_scale), args.algo, args.hash_size, args.resize)
+                d2 = None
+                if len(play2_refs) and roi_play2:
+                    hp2 = get_hash(crop(full, roi_play2, args.decode_scale), args.algo, args.hash_size, args.resize)
+                    d2 = min_dist(hp2, play2_refs)
 
-            dsel.append(min_dist(hs, sel_refs))
-            dplay1.append(min_dist(hp1, play1_refs))
+                last_key, last_d = key, (min_dist(hs, sel_refs), min_dist(hp1, play1_refs), d2)
 
-            if play2_refs and roi_play2:
-                hp2 = get_hash(crop(full, roi_play2), args.algo, args.hash_size)
-                dplay2.append(min_dist(hp2, play2_refs))
+            dsel.append(last_d[0])
+            dplay1.append(last_d[1])
+            if last_d[2] is not None:
+                dplay2.append(last_d[2])
 
         except Exception:
             atomic_write(args.out, f"ts={ts_iso()} epoch={int(time.time())} state=UNKNOWN reason=image_decode_failed\n")
-            print("UNKNOWN image_decode_failed")
-            sys.exit(2)
+            return "UNKNOWN"
 
         if i < args.samples - 1:
             time.sleep(args.interval)
@@ -439,13 +541,90 @@ def main():
         f"select_mean={sel_mean:.2f} select_th={th_select} select_list={','.join(map(str,dsel))} "
         f"play_mean={play_mean:.2f} play_th={th_play} play1_mean={play_mean1:.2f} play2_mean={play_mean2:.2f} "
         f"play1_list={','.join(map(str,dplay1))} play2_list={','.join(map(str,dplay2)) if dplay2 else '-'} "
-        f"bestk={k} algo={args.algo} hash_size={args.hash_size} "
+        f"bestk={k} algo={args.algo} hash_size={args.hash_size} resize={args.resize} decode_scale={args.decode_scale} "
         f"confirm_select={args.confirm_select} confirm_play={args.confirm_play} "
         f"drop_select_none={args.drop_select_none} drop_play_none={args.drop_play_none} "
         f"select_streak={ss} play_streak={ps} none_streak={ns} "
-        f"refs_select={len(sel_refs)} refs_play1={len(play1_refs)} refs_play2={len(play2_refs) if play2_refs else 0}\n"
+        f"refs_select={len(sel_refs)} refs_play1={len(play1_refs)} refs_play2={len(play2_refs)}\n"
     )
     atomic_write(args.out, line)
+    return state
+
+# -------------------------
+# main
+# -------------------------
+def main():
+    ap = argparse.ArgumentParser()
+
+    ap.add_argument("--snap", default="/dev/shm/freegame/snap.jpg")
+    ap.add_argument("--out", default="/dev/shm/freegame/freegame.status")
+
+    # refs path（用來判斷 refs 是否更新）
+    ap.add_argument("--ref-select", required=True, help="SELECT refs folder or file")
+    ap.add_argument("--ref-play", required=True, help="PLAY refs folder or file")
+
+    # ROI（必須與 build_refhash 一致）
+    ap.add_argument("--roi-select", required=True, help="x,y,w,h")
+    ap.add_argument("--roi-play1", required=True, help="x,y,w,h")
+    ap.add_argument("--roi-play2", default=None, help="x,y,w,h (optional)")
+
+    # thresholds
+    ap.add_argument("--select-enter", type=int, default=12)
+    ap.add_argument("--select-exit", type=int, default=16)
+    ap.add_argument("--play-enter", type=int, default=12)
+    ap.add_argument("--play-exit", type=int, default=16)
+
+    # sampling
+    ap.add_argument("--samples", type=int, default=3)
+    ap.add_argument("--interval", type=float, default=0.15)
+    ap.add_argument("--bestk", type=int, default=0, help="0 => auto (=need)")
+
+    # hash settings（必須與 build_refhash 一致）
+    ap.add_argument("--algo", default="dhash", choices=["phash", "dhash", "ahash"])
+    ap.add_argument("--hash-size", type=int, default=8)
+    ap.add_argument("--resize", default="lanczos", choices=list(RESIZE_FILTERS), help="hash downscale filter (box: faster, different hashes)")
+    ap.add_argument("--decode-scale", type=int, default=1, choices=DECODE_SCALES, help="decode the snap at 1/N size (ROIs stay in full-size coords)")
+
+    # debounce
+    ap.add_argument("--confirm-select", type=int, default=2)
+    ap.add_argument("--confirm-play", type=int, default=2)
+    ap.add_argument("--drop-select-none", type=int, default=6)
+    ap.add_argument("--drop-play-none", type=int, default=6)
+
+    # cache settings
+    ap.add_argument("--refhash-dir", default="/dev/shm/freegame")
+    ap.add_argument("--refhash-prefix", default="refhash")
+    ap.add_argument("--auto-rebuild-cache", type=int, default=1, help="1: missing/invalid cache -> rebuild via build_refhash")
+    ap.add_argument("--build-refhash", default="", help="path to build_refhash.py (optional)")
+
+    # daemon：常駐執行，refs hash 留在記憶體，每 --daemon-interval 秒分類一次 (取代 timer 每次重新啟動)
+    ap.add_argument("--daemon", action="store_true", help="run forever instead of one classification")
+    ap.add_argument("--daemon-interval", type=float, default=2.0, help="seconds between classifications in --daemon mode")
+
+    args = ap.parse_args()
+
+    roi_select = parse_roi(args.roi_select)
+    roi_play1  = parse_roi(args.roi_play1)
+    roi_play2  = parse_roi(args.roi_play2) if args.roi_play2 else None
+
+    if args.daemon:
+        run_daemon(args, roi_select, roi_play1, roi_play2)
+        return
+
+    if not os.path.isfile(args.snap):
+        atomic_write(args.out, f"ts={ts_iso()} epoch={int(time.time())} state=UNKNOWN reason=snap_missing\n")
+        print("UNKNOWN snap_missing")
+        sys.exit(2)
+
+    # load ref hashes from /dev/shm (or rebuild)
+    try:
+        refs, cache_status = load_or_build_refhashes(args, roi_select, roi_play1, roi_play2)
+    except Exception as e:
+        write_refhash_failed(args.out, e)
+        print(f"UNKNOWN refhash_failed: {e}")
+        sys.exit(2)
+
+    state = classify(args, roi_select, roi_play1, roi_play2, refs, cache_status)
 
     if state == "PLAY":
         print("FREEGAME=PLAY")
@@ -453,9 +632,12 @@ def main():
     elif state == "SELECT":
         print("FREEGAME=SELECT")
         sys.exit(0)
+    elif state == "UNKNOWN":
+        print("UNKNOWN image_decode_failed")
+        sys.exit(2)
     else:
         print("FREEGAME=NO")
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -20,14 +20,27 @@ def require_token(x_token: Optional[str]):
   if token and x_token != token:
     raise HTTPException(status_code=401, detail="bad token")
 
-def safe_read_bytes(path: str) -> bytes:
-  with open(path, "rb") as f:
-    data = f.read()
-  if not data:
-    raise ValueError("empty snap")
-  img = Image.open(io.BytesIO(data))
-  img.verify()
-  return data
+def safe_read_bytes(path: str, tries: int = 5, sleep_s: float = 0.02) -> bytes:
+  last = None
+  for _ in range(tries):
+    try:
+      with open(path, "rb") as f:
+        data = f.read()
+      if not data:
+        raise ValueError("empty snap")
+      if data[:3] == b"\xff\xd8\xff":
+        # JPEG：verify() 只看檔頭，抓不到寫到一半的檔；直接檢查結尾 EOI marker 就夠了，不必 Image.open
+        if data[-2:] != b"\xff\xd9":
+          raise ValueError("truncated snap")
+      else:
+        img = Image.open(io.BytesIO(data))
+        img.verify()
+      return data
+    except Exception as e:
+      # snap 正在被改寫：稍等再讀
+      last = e
+      time.sleep(sleep_s)
+  raise last
 
 def atomic_write(dst: Path, data: bytes):
   dst.parent.mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,55 @@
+import asyncio
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+from egm_streamer import api
+from egm_streamer.models import AppConfig, SnapshotServiceConfig
+
+
+def _client(tmp_path):
+    snap = tmp_path / "latest.jpg"
+    snap.write_bytes(b"\xff\xd8\xff\xe0jpeg\xff\xd9")
+    cfg = AppConfig(snapshot=SnapshotServiceConfig(enabled=True, output_path=str(snap)))
+    # No `with`: the lifespan (snapshot loop / FFmpeg) is not started
+    return TestClient(api.create_app(cfg, {}))
+
+
+def test_live_frame_etag_304(tmp_path):
+    c = _client(tmp_path)
+    r = c.get("/api/live/frame")
+    assert r.status_code == 200
+    etag = r.headers["etag"]
+
+    for inm in (etag, f"W/{etag}", f'"other", {etag}', f'"other" , W/{etag}', "*"):
+        r2 = c.get("/api/live/frame", headers={"If-None-Match": inm})
+        assert r2.status_code == 304, inm
+        assert r2.content == b""
+        assert r2.headers["etag"] == etag
+
+
+def test_live_frame_etag_mismatch(tmp_path):
+    c = _client(tmp_path)
+    etag = c.get("/api/live/frame").headers["etag"]
+    # Substrings / unquoted forms of the tag must not match
+    for inm in ('"other"', etag.strip('"'), etag[:-2] + '"', f'"x{etag[1:]}'):
+        assert c.get("/api/live/frame", headers={"If-None-Match": inm}).status_code == 200, inm
+
+
+def test_cancelled_thread_call_waits_for_thread():
+    done = threading.Event()
+
+    def work():
+        time.sleep(0.2)
+        done.set()
+
+    async def main():
+        t = asyncio.ensure_future(api._in_thread(work))
+        await asyncio.sleep(0.05)
+        t.cancel()
+        await asyncio.gather(t, return_exceptions=True)
+        # The task only finishes once the thread has returned
+        return t.cancelled(), done.is_set()
+
+    assert asyncio.run(main()) == (True, True)
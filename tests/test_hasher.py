@@ -0,0 +1,43 @@
+import numpy as np
+import imagehash
+from PIL import Image
+
+from egm_streamer.hasher import compute_hash, pack_hash
+
+HASH_SIZES = (4, 8, 16)
+
+
+def _crops():
+    """Flat, gradient and noisy grayscale crops; flat / gradient put many DCT terms at the median"""
+    rng = np.random.default_rng(0)
+    crops = []
+    for v in (0, 1, 37, 128, 255):
+        crops.append(np.full((48, 64), v, dtype=np.uint8))
+    x = np.linspace(0, 255, 64)
+    y = np.linspace(0, 255, 48)
+    crops.append(np.tile(x, (48, 1)).astype(np.uint8))
+    crops.append(np.tile(y[:, None], (1, 64)).astype(np.uint8))
+    crops.append(((x[None, :] + y[:, None]) / 2).astype(np.uint8))
+    crops.append(np.tile(np.repeat([0, 255], 8), (48, 4)).astype(np.uint8))
+    for _ in range(20):
+        crops.append(rng.integers(0, 256, (48, 64), dtype=np.uint8))
+    return crops
+
+
+def test_phash_matches_imagehash():
+    for hash_size in HASH_SIZES:
+        for crop in _crops():
+            img = Image.fromarray(crop, "L")
+            expected = pack_hash(imagehash.phash(img, hash_size=hash_size))
+            got = compute_hash(crop, "phash", hash_size)
+            assert np.array_equal(got, expected), (hash_size, crop[:2, :4])
+
+
+def test_dhash_ahash_match_imagehash():
+    for hash_size in HASH_SIZES:
+        for crop in _crops():
+            img = Image.fromarray(crop, "L")
+            assert np.array_equal(compute_hash(crop, "dhash", hash_size),
+                                  pack_hash(imagehash.dhash(img, hash_size=hash_size)))
+            assert np.array_equal(compute_hash(crop, "ahash", hash_size),
+                                  pack_hash(imagehash.average_hash(img, hash_size=hash_size)))
@@ -0,0 +1,61 @@
+import numpy as np
+
+from egm_streamer.hasher import compute_hash
+from egm_streamer.matcher import Matcher
+from egm_streamer.models import ROI, MatchPolicy
+
+
+class _Refs:
+    """Minimal stand-in for ReferenceManager: packed refs per (state, roi)"""
+
+    def __init__(self, refs):
+        self.refs = refs
+
+    def get_packed(self, state_name, roi_name):
+        return self.refs.get((state_name, roi_name), np.empty((0, 1), dtype=np.uint64))
+
+    def get_packed_concat(self, keys):
+        mats = [self.get_packed(s, r) for s, r in keys]
+        counts = np.array([len(m) for m in mats], dtype=np.intp)
+        owner = np.repeat(np.arange(len(keys), dtype=np.intp), counts)
+        return np.concatenate(mats), owner, counts
+
+
+class _CountingMatcher(Matcher):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hashed = []
+
+    def _roi_hashes(self, img, rois):
+        self.hashed.extend(roi.name for roi in rois)
+        return super()._roi_hashes(img, rois)
+
+
+def _frame():
+    return np.random.default_rng(0).integers(0, 256, (120, 160), dtype=np.uint8)
+
+
+def test_match_states_skips_states_that_cannot_match():
+    img = _frame()
+    a = ROI(name="a", x=0, y=0, w=40, h=40)
+    b = ROI(name="b", x=50, y=0, w=40, h=40)
+    c = ROI(name="c", x=0, y=50, w=40, h=40)
+    refs = _Refs({
+        ("OK", "a"): compute_hash(img[0:40, 0:40]).reshape(1, -1),
+        ("NOREQ", "b"): compute_hash(img[0:40, 50:90]).reshape(1, -1),
+        ("FEW", "c"): compute_hash(img[50:90, 0:40]).reshape(1, -1),
+    })
+    m = _CountingMatcher(refs)
+    plans = [
+        ("OK", [a], MatchPolicy()),
+        # required ROI without refs: fixed to False
+        ("NOREQ", [b, ROI(name="req", x=100, y=50, w=40, h=40, required=True)], MatchPolicy()),
+        # only one ROI with refs but min_match=2: fixed to False
+        ("FEW", [c, ROI(name="d", x=100, y=0, w=40, h=40)], MatchPolicy(min_match=2)),
+    ]
+    res = m.match_states(img, plans)
+
+    assert res["OK"] == (True, ["a"], 0.0)
+    assert "NOREQ" not in res
+    assert "FEW" not in res
+    assert m.hashed == ["a"]